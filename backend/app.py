@@ -1,189 +1,544 @@
-
-from flask import Flask, request, send_file, send_from_directory, jsonify
-import yt_dlp
-import instaloader
+from flask import Flask, Response, g, request, send_file, send_from_directory, jsonify, stream_with_context, url_for
+from werkzeug.wsgi import ClosingIterator
+import json
 import os
 import logging
+import threading
+import time
+
+import config
+import metrics
+from batch import check_urls
+from downloader import (
+    downloads_in_flight, enqueue_download, extractions_in_flight, get_highlight, get_instagram_post, get_profile,
+    instagram_metadata, instagram_pool, media_store, metadata_cache, negative_cache, partial_path, rate_limiter,
+    scratch, story_index, youtube_metadata, youtube_pool,
+)
+from failures import MediaUnavailable
+from jobs import Job, JobManager, ShuttingDown
+from playlists import playlist_jobs, playlist_zip
+from posts import post_zip, zip_items
+from profiles import archive_marks, profile_zip
+from ratelimit import is_throttled
+from scratch import ScratchFull
+from stories import story_files
+from urls import classify, platform_of
+from streaming import content_disposition, follow, open_source, read_range
 
 # Configure logging
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=config.LOG_LEVEL,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[logging.StreamHandler()]
 )
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder='../frontend', template_folder='../frontend')
+app.config['USE_X_SENDFILE'] = config.USE_X_SENDFILE
+
+
+class SingleCloseResponse(Response):
+    # A media response is closed by the server and, through its file, by
+    # send_media as well; its close callbacks still run only once
+    _closed = False
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        super().close()
+
+
+app.response_class = SingleCloseResponse
+
+job_manager = JobManager(
+    workers=config.DOWNLOAD_WORKERS,
+    platform_limits={'instagram': config.INSTAGRAM_CONCURRENCY, 'youtube': config.YOUTUBE_CONCURRENCY},
+    job_ttl=config.JOB_TTL,
+)
+started = threading.Event()
+
+# Counts the components already keep, read when /metrics is scraped
+metrics.registry.collect('downloader_jobs_running', 'Download jobs running', lambda: job_manager.stats()["running"],
+                         labels=('platform',))
+metrics.registry.collect('downloader_jobs_pending', 'Download jobs waiting for a platform slot',
+                         lambda: job_manager.stats()["pending"], labels=('platform',))
+metrics.registry.collect('downloader_media_store_bytes', 'Bytes held by the media store',
+                         lambda: media_store.stats()["bytes"])
+metrics.registry.collect('downloader_metadata_cache_hits_total', 'Metadata cache hits',
+                         lambda: metadata_cache.stats()["hits"], type='counter')
+metrics.registry.collect('downloader_metadata_cache_misses_total', 'Metadata cache misses',
+                         lambda: metadata_cache.stats()["misses"], type='counter')
+metrics.registry.collect('downloader_coalesced_total', 'Calls that shared an in-flight result instead of running',
+                         lambda: {'extraction': extractions_in_flight.coalesced,
+                                  'download': downloads_in_flight.coalesced},
+                         type='counter', labels=('operation',))
+
+def rate_limit_stat(field):
+    # Per-bucket values of the limiter's stats, labelled by bucket name
+    return lambda: {name: bucket[field] for name, bucket in rate_limiter.stats().items()}
+
+metrics.registry.collect('downloader_rate_limit_blocked_seconds', 'Seconds a rate limit bucket stays backed off',
+                         rate_limit_stat("blocked_for"), labels=('bucket',))
+metrics.registry.collect('downloader_rate_limit_waits_total', 'Requests that waited for a rate limit token',
+                         rate_limit_stat("waits"), type='counter', labels=('bucket',))
+metrics.registry.collect('downloader_rate_limit_wait_seconds_total', 'Seconds spent waiting for rate limit tokens',
+                         rate_limit_stat("wait_seconds"), type='counter', labels=('bucket',))
+
+def create_app():
+    # Application factory for WSGI servers: `gunicorn -c gunicorn.conf.py
+    # "app:create_app()"`. Warms the YoutubeDL pool and starts the scratch
+    # sweeper once per process, then returns the app.
+    if not started.is_set():
+        started.set()
+        youtube_pool.warm()
+        scratch.start_sweeper(config.SCRATCH_SWEEP_INTERVAL)
+        logger.info("App ready: %s download workers, log level %s", config.DOWNLOAD_WORKERS, config.LOG_LEVEL)
+    return app
+
+def create_asgi_app():
+    # For ASGI servers: `uvicorn --factory app:create_asgi_app`. Needs asgiref;
+    # each request still runs on a worker thread, as under gunicorn.
+    try:
+        from asgiref.wsgi import WsgiToAsgi
+    except ImportError:
+        raise RuntimeError("Serving over ASGI needs asgiref: pip install asgiref") from None
+    return WsgiToAsgi(create_app())
+
+def shutdown(timeout=config.DRAIN_TIMEOUT):
+    # Called by the WSGI server when the worker exits: new downloads are
+    # refused with a 503 while running ones get `timeout` seconds to finish.
+    drained = job_manager.drain(timeout)
+    logger.info("Shutdown %s", 'complete' if drained else 'timed out')
+    return drained
+
+@app.before_request
+def start_timings():
+    g.started = time.perf_counter()
+    g.timings = metrics.Timings()
+    metrics.activate(g.timings)
+
+@app.after_request
+def record_request(response):
+    # The body is sent after this returns, so the request is timed, and its
+    # spans observed, when the server closes the response
+    timings, started = g.timings, g.started
+    endpoint, status = request.endpoint or 'unknown', response.status_code
+
+    def finish():
+        metrics.requests_total.inc(endpoint=endpoint, status=status)
+        metrics.request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+        timings.finish()
+
+    response.call_on_close(finish)
+    return response
+
+@app.teardown_request
+def stop_timings(error=None):
+    metrics.activate(None)
+
+def time_send(response):
+    # Records the 'send' span once the server has written the whole body
+    timings, started = g.timings, time.perf_counter()
+    response.call_on_close(lambda: timings.record('send', time.perf_counter() - started))
+    return response
 
 @app.route('/')
 def index():
     logger.info("Serving index.html")
-    return send_from_directory('../frontend', 'index.html')
+    return send_from_directory(app.static_folder, 'index.html')
 
 @app.route('/check', methods=['POST'])
 def check_media():
     url = request.form.get('url')
-    logger.info(f"Received check request: URL={url}")
+    logger.info("Received check request: URL=%s", url)
 
     if not url:
         logger.error("No URL provided in the request")
         return jsonify({"error": "No URL provided"}), 400
 
-    # Check if URL is Instagram
-    if 'instagram.com' in url:
+    with metrics.span('parse'):
+        ref = classify(url)
+    metrics.label(platform=ref.platform)
+    if ref.platform == 'instagram':
         try:
-            L = instaloader.Instaloader()
-            shortcode = url.split('/')[-2] if url.endswith('/') else url.split('/')[-1]
-            if 'p/' in url or 'reel/' in url:
-                post = instaloader.Post.from_shortcode(L.context, shortcode)
-                metadata = {
-                    "title": post.caption or 'Instagram Post',
-                    "duration": post.video_duration if post.is_video else 0,
-                    "thumbnail": post.url if not post.is_video else post.video_url,
-                    "quality": "HD"
-                }
-                logger.info(f"Instagram metadata extracted: {metadata}")
+            if ref.kind in ('post', 'story', 'highlight', 'profile'):
+                with instagram_pool.lease(timeout=config.INSTAGRAM_LEASE_TIMEOUT) as L:
+                    metadata = instagram_metadata(L, url)
+                logger.info("Instagram %s metadata extracted for %s", ref.kind, ref.id)
+                logger.debug("Instagram metadata: %s", metadata)
+                # Collections are downloaded as a zip rather than through a job
+                if ref.kind == 'highlight':
+                    metadata["zip_url"] = url_for('highlight_archive', highlight_id=ref.id)
+                elif ref.kind == 'profile':
+                    metadata["zip_url"] = url_for('profile_archive', username=ref.id)
+                elif ref.kind == 'post' and metadata["type"] != 'video':
+                    metadata["zip_url"] = url_for('post_archive', shortcode=ref.id)
                 return jsonify(metadata)
             else:
-                return jsonify({"error": "Only Instagram posts and reels are supported"}), 400
+                error = "Only Instagram posts, reels, stories, highlights and profiles are supported"
+                return jsonify({"error": error}), 400
         except Exception as e:
-            logger.exception(f"Error checking Instagram media: {str(e)}")
-            return jsonify({"error": str(e)}), 400
+            return instagram_error(e, "checking Instagram media")
 
     # YouTube metadata
-    options = {
-        'format': 'best',
-        'noplaylist': True,
-        'quiet': True,
-    }
     try:
-        with yt_dlp.YoutubeDL(options) as ydl:
-            info = ydl.extract_info(url, download=False)
-            metadata = {
-                "title": info.get('title', 'Unknown Title'),
-                "duration": info.get('duration', 0),
-                "thumbnail": info.get('thumbnail', ''),
-                "quality": info.get('resolution', 'Unknown Quality'),
-            }
-            logger.info(f"YouTube metadata extracted: {metadata}")
-            return jsonify(metadata)
+        with youtube_pool.lease('check') as ydl:
+            metadata = youtube_metadata(ydl, url)
+        logger.info("YouTube metadata extracted for %s", ref.id)
+        logger.debug("YouTube metadata: %s", metadata)
+        return jsonify(metadata)
     except Exception as e:
-        logger.exception(f"Error checking YouTube media: {str(e)}")
+        if is_throttled(e):
+            return rate_limited(e, 'youtube')
+        if isinstance(e, MediaUnavailable):
+            return unavailable(e)
+        logger.exception("Error checking YouTube media: %s", e)
         return jsonify({"error": str(e)}), 400
 
+def instagram_error(error, action):
+    if is_throttled(error):
+        return rate_limited(error, 'instagram')
+    if isinstance(error, MediaUnavailable):
+        return unavailable(error)
+    logger.exception("Error %s: %s", action, error)
+    return jsonify({"error": str(error)}), 400
+
+def unavailable(error):
+    # Known-bad URL answered from the negative cache; no traceback this time
+    logger.info("Rejected from negative cache (%s): %s", error.reason, error)
+    return jsonify({"error": str(error), "reason": error.reason}), 400
+
+def rate_limited(error, platform):
+    retry_after = max(getattr(error, 'retry_after', 0), rate_limiter.blocked_for((platform,)), 1)
+    logger.warning("Rate limited checking %s media: %s", platform, error)
+    response = jsonify({"error": "Too many requests, try again later", "retry_after": round(retry_after)})
+    return response, 429, {'Retry-After': str(round(retry_after))}
+
+@app.route('/check/batch', methods=['POST'])
+def check_batch():
+    # Body is a JSON array of URLs (or {"urls": [...]}). Results stream back as
+    # NDJSON in completion order, one line per input URL, tagged with its index.
+    urls = request.get_json(silent=True)
+    if isinstance(urls, dict):
+        urls = urls.get('urls')
+    if not isinstance(urls, list) or not urls or not all(isinstance(url, str) for url in urls):
+        return jsonify({"error": "Expected a JSON array of URLs"}), 400
+    if len(urls) > config.BATCH_MAX_URLS:
+        return jsonify({"error": f"At most {config.BATCH_MAX_URLS} URLs per batch"}), 413
+
+    logger.info("Received batch check request for %s URLs", len(urls))
+    lines = (json.dumps(result) + '\n' for result in check_urls(urls))
+    return Response(lines, mimetype='application/x-ndjson')
+
 @app.route('/download', methods=['POST'])
 def download_video():
     url = request.form.get('url')
     format_type = request.form.get('format', 'mp4')
+    stream = request.form.get('stream') in ('1', 'true')
     
-    logger.info(f"Received download request: URL={url}, Format={format_type}")
+    logger.info("Received download request: URL=%s, Format=%s, Stream=%s", url, format_type, stream)
 
     if not url:
         logger.error("No URL provided in the request")
         return jsonify({"error": "No URL provided"}), 400
 
-    # Instagram download
-    if 'instagram.com' in url:
+    with metrics.span('parse'):
+        platform = platform_of(url)
+    metrics.label(platform=platform, format=format_type)
+    try:
+        job = enqueue_download(job_manager, Job(url, format_type, platform, stream=stream))
+    except ScratchFull as e:
+        return jsonify({"error": str(e)}), 507
+    except ShuttingDown as e:
+        return jsonify({"error": str(e)}), 503
+
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": url_for('job_status', job_id=job.id),
+        "file_url": url_for('job_file', job_id=job.id),
+        "stream_url": url_for('job_stream', job_id=job.id),
+        "events_url": url_for('job_events', job_id=job.id),
+    }), 202
+
+@app.route('/download/playlist', methods=['POST'])
+def download_playlist():
+    # Expands a playlist or channel and queues one download job per entry.
+    # mode=manifest streams an NDJSON line per queued job as the playlist is
+    # walked; mode=zip streams a zip of the files as the downloads finish.
+    url = request.form.get('url')
+    format_type = request.form.get('format', 'mp4')
+    mode = request.form.get('mode', 'manifest')
+    limit = min(request.form.get('limit', config.PLAYLIST_MAX_ENTRIES, type=int), config.PLAYLIST_MAX_ENTRIES)
+
+    logger.info("Received playlist request: URL=%s, Format=%s, Mode=%s, Limit=%s", url, format_type, mode, limit)
+
+    if not url:
+        logger.error("No URL provided in the request")
+        return jsonify({"error": "No URL provided"}), 400
+    if platform_of(url) != 'youtube':
+        return jsonify({"error": "Only YouTube playlists and channels are supported"}), 400
+    # Refused up front: once the stream has started, a refusal can only show
+    # up as an error line or a truncated zip
+    try:
+        job_manager.check_accepting()
+        scratch.check_room()
+    except ScratchFull as e:
+        return jsonify({"error": str(e)}), 507
+    except ShuttingDown as e:
+        return jsonify({"error": str(e)}), 503
+
+    if mode == 'zip':
+        return Response(playlist_zip(job_manager, url, format_type, limit), mimetype='application/zip', headers={
+            'Content-Disposition': content_disposition('playlist.zip'),
+        })
+
+    def manifest():
         try:
-            L = instaloader.Instaloader()
-            shortcode = url.split('/')[-2] if url.endswith('/') else url.split('/')[-1]
-            if 'p/' in url or 'reel/' in url:
-                post = instaloader.Post.from_shortcode(L.context, shortcode)
-                if post.is_video:
-                    file_path = f"downloads/{post.owner_username}_{shortcode}.mp4"
-                    L.download_post(post, target='downloads')
-                    for file in os.listdir('downloads'):
-                        if file.endswith('.mp4') and shortcode in file:
-                            file_path = os.path.join('downloads', file)
-                            break
-                else:
-                    return jsonify({"error": "Only video posts are supported"}), 400
-
-                if not os.path.exists(file_path):
-                    logger.error(f"Instagram file not found at {file_path}")
-                    return jsonify({"error": "File not downloaded"}), 500
-
-                file_size = os.path.getsize(file_path)
-                logger.info(f"Instagram file size: {file_size} bytes")
-
-                download_name = f"{post.owner_username}_{shortcode}.mp4"
-                logger.info(f"Sending Instagram file: {file_path} as {download_name}")
-                response = send_file(file_path, as_attachment=True, download_name=download_name)
-
-                logger.info(f"Cleaning up: Removing {file_path}")
-                os.remove(file_path)
-
-                return response
-            else:
-                return jsonify({"error": "Only Instagram posts and reels are supported"}), 400
+            for index, title, job in playlist_jobs(job_manager, url, format_type, limit):
+                yield json.dumps({
+                    "index": index,
+                    "title": title,
+                    "url": job.url,
+                    "job_id": job.id,
+                    "status_url": url_for('job_status', job_id=job.id),
+                    "file_url": url_for('job_file', job_id=job.id),
+                }) + '\n'
         except Exception as e:
-            logger.exception(f"Error downloading Instagram media: {str(e)}")
-            return jsonify({"error": str(e)}), 400
-
-    # YouTube download
-    options = {
-        'outtmpl': 'downloads/%(title)s.%(ext)s',
-        'noplaylist': True,
-    }
-
-    if format_type == 'mp4':
-        options.update({
-            'format': 'bestvideo[vcodec~="^h264$"][ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]',
-            'merge_output_format': 'mp4',
-            'recode_video': 'mp4',
-            'postprocessors': [{
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': 'mp4',
-            }],
-        })
-    else:  # MP3
-        options.update({
-            'format': 'bestaudio[ext=m4a]/bestaudio',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-        })
+            logger.exception("Error expanding playlist %s: %s", url, e)
+            yield json.dumps({"error": str(e)}) + '\n'
 
+    return Response(stream_with_context(manifest()), mimetype='application/x-ndjson')
+
+@app.route('/posts/<shortcode>.zip', methods=['GET'])
+def post_archive(shortcode):
+    # Image and carousel posts: all items, fetched in parallel from the CDN
+    # and streamed as a zip. Reuses the post resolved by /check when cached.
+    url = f"https://www.instagram.com/p/{shortcode}/"
+    metrics.label(platform='instagram', format='zip')
     try:
-        if not os.path.exists('downloads'):
-            logger.info("Creating downloads directory")
-            os.makedirs('downloads')
-
-        logger.debug(f"yt-dlp options: {options}")
-        with yt_dlp.YoutubeDL(options) as ydl:
-            logger.info(f"Starting download for URL: {url}")
-            info = ydl.extract_info(url, download=True)
-            file_path = ydl.prepare_filename(info)
-            if format_type == 'mp4' and not file_path.endswith('.mp4'):
-                file_path = file_path.rsplit('.', 1)[0] + '.mp4'
-            elif format_type == 'mp3':
-                file_path = file_path.rsplit('.', 1)[0] + '.mp3'
-            logger.info(f"Download completed. File path: {file_path}")
-
-        if not os.path.exists(file_path):
-            logger.error(f"File not found at {file_path} after download")
-            return jsonify({"error": "File not downloaded"}), 500
-
-        file_size = os.path.getsize(file_path)
-        logger.info(f"File size: {file_size} bytes")
-
-        download_name = f"{info.get('title', 'media')}.{format_type}"
-        logger.info(f"Sending file: {file_path} as {download_name}")
-        response = send_file(file_path, as_attachment=True, download_name=download_name)
-
-        logger.info(f"Cleaning up: Removing {file_path}")
-        os.remove(file_path)
-
-        return response
+        with instagram_pool.lease(timeout=config.INSTAGRAM_LEASE_TIMEOUT) as L:
+            post = get_instagram_post(L, url)
     except Exception as e:
-        logger.exception(f"Error downloading video: {str(e)}")
-        return jsonify({"error": str(e)}), 400
+        return instagram_error(e, f"resolving Instagram post {shortcode}")
+
+    logger.info("Streaming %s items of %s as a zip", post.mediacount, shortcode)
+    return time_send(Response(post_zip(post), mimetype='application/zip', headers={
+        'Content-Disposition': content_disposition(f"{post.owner_username}_{shortcode}.zip"),
+    }))
+
+@app.route('/highlights/<int:highlight_id>.zip', methods=['GET'])
+def highlight_archive(highlight_id):
+    # Every item of a highlight, streamed as a zip like a carousel post
+    url = f"https://www.instagram.com/stories/highlights/{highlight_id}/"
+    metrics.label(platform='instagram', format='zip')
+    try:
+        with instagram_pool.lease(timeout=config.INSTAGRAM_LEASE_TIMEOUT) as L:
+            username, title, items = get_highlight(L, url)
+    except Exception as e:
+        return instagram_error(e, f"resolving Instagram highlight {highlight_id}")
+
+    logger.info("Streaming %s items of highlight %s as a zip", len(items), highlight_id)
+    files = story_files(username, f"highlight_{highlight_id}", items)
+    return time_send(Response(zip_items(files), mimetype='application/zip', headers={
+        'Content-Disposition': content_disposition(f"{username}_highlight_{highlight_id}.zip"),
+    }))
+
+@app.route('/profiles/<username>.zip', methods=['GET'])
+def profile_archive(username):
+    # A profile's posts as a zip, newest first. Without parameters only posts
+    # newer than the last archive of the profile are included, or the older
+    # posts an archive cut short at its limit left behind; ?since=<unix
+    # timestamp> picks the starting point instead and ?full=1 takes them all.
+    url = f"https://www.instagram.com/{username}/"
+    metrics.label(platform='instagram', format='zip')
+    before = None
+    if request.args.get('full'):
+        since = None
+    elif request.args.get('since'):
+        try:
+            since = int(request.args['since'])
+        except ValueError:
+            return jsonify({"error": "since must be a unix timestamp"}), 400
+    else:
+        mark = archive_marks.get(username) or {}
+        backfill = mark.get("backfill")
+        if backfill:
+            since, before = backfill["since"], backfill["before"]
+        else:
+            since = mark.get("timestamp")
+    try:
+        with instagram_pool.lease(timeout=config.INSTAGRAM_LEASE_TIMEOUT) as L:
+            profile = get_profile(L, url)
+    except Exception as e:
+        return instagram_error(e, f"resolving Instagram profile {username}")
+    if profile.is_private and not profile.followed_by_viewer:
+        return jsonify({"error": f"Profile {profile.username} is private", "reason": "private"}), 400
+
+    logger.info("Streaming posts of %s since %s before %s as a zip", profile.username, since, before)
+    name = f"{profile.username}_since_{since}.zip" if since else f"{profile.username}.zip"
+    if before:
+        name = f"{name[:-len('.zip')]}_before_{before}.zip"
+    return time_send(Response(profile_zip(profile, since, before), mimetype='application/zip', headers={
+        'Content-Disposition': content_disposition(name),
+    }))
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        "jobs": job_manager.stats(),
+        "metadata_cache": metadata_cache.stats(),
+        "negative_cache": negative_cache.stats(),
+        "story_index": story_index.stats(),
+        "media_store": media_store.stats(),
+        "downloads_in_flight": downloads_in_flight.stats(),
+        "extractions_in_flight": extractions_in_flight.stats(),
+        "instagram_pool": instagram_pool.stats(),
+        "youtube_pool": youtube_pool.stats(),
+        "scratch": scratch.stats(),
+        "rate_limits": rate_limiter.stats(),
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    status = job.to_dict()
+    if job.status == 'finished':
+        # Outlives the job: stays valid for as long as the store keeps the file
+        status["media_url"] = url_for('media_file', digest=media_store.path_digest(job.file_path))
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    # Server-Sent Events stream of the job's progress snapshots. Reconnecting
+    # clients send Last-Event-ID and pick up from there.
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    after = request.headers.get('Last-Event-ID', 0, type=int)
+
+    def stream():
+        seq = after
+        while True:
+            events = job.events.wait(after=seq, timeout=config.SSE_HEARTBEAT)
+            for event in events:
+                seq = event['seq']
+                yield f"id: {seq}\nevent: progress\ndata: {json.dumps(event)}\n\n"
+            if job.events.closed and not job.events.wait(after=seq, timeout=0):
+                return
+            if not events:
+                # Comment line keeps proxies from timing out an idle stream
+                yield ": keep-alive\n\n"
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/jobs/<job_id>/file', methods=['GET'])
+def job_file(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job.status == 'failed':
+        return jsonify({"error": job.error}), 400
+    if job.status != 'finished':
+        return jsonify({"error": "Job not finished", "status": job.status}), 409
+    metrics.label(platform=job.platform, format=job.format_type)
+    return send_media(job.file_path, job.download_name)
+
+@app.route('/media/<digest>', methods=['GET'])
+def media_file(digest):
+    # Stable URL for a finished file, independent of the job that produced it
+    entry = media_store.lookup(digest)
+    if entry is None:
+        return jsonify({"error": "File no longer available"}), 410
+    # Store keys are (media key, format, quality); media keys start with the platform
+    metrics.label(platform=entry.key[0].split(':')[0], format=entry.key[1])
+    return send_media(entry.path, entry.download_name)
+
+def send_media(path, download_name):
+    # Answers Range/If-Range/If-None-Match against an ETag derived from the
+    # store entry, so clients can resume and seek. The body goes through the
+    # server's wsgi.file_wrapper (sendfile(2) under gunicorn), or X-Sendfile
+    # when enabled.
+    if config.USE_X_SENDFILE:
+        # The front server opens the file itself after this returns; the
+        # entry was just looked up, so the grace period keeps it on disk
+        return time_send(send_file(path, as_attachment=True, download_name=download_name, conditional=True,
+                                   etag=media_etag(path, os.stat(path))))
+    try:
+        # Pinned until the file is closed, so eviction can't pull it out from
+        # under a send in progress
+        f = media_store.open(path)
+    except FileNotFoundError:
+        logger.error("File not found at %s", path)
+        return jsonify({"error": "File no longer available"}), 410
+
+    try:
+        st = os.fstat(f.fileno())
+        logger.info("Sending file: %s as %s", path, download_name)
+        response = send_file(f, as_attachment=True, download_name=download_name, conditional=False,
+                             etag=media_etag(path, st), last_modified=st.st_mtime)
+        # send_file only sizes paths, so the conditional handling it would do
+        # for one is done here
+        response.content_length = st.st_size
+        response = response.make_conditional(request, accept_ranges=True, complete_length=st.st_size)
+        if response.status_code == 206:
+            # The server's file wrapper can't seek, so a range sent through it
+            # reads and drops every byte before its start. Full bodies keep
+            # the wrapper (and sendfile); a range is read from where it starts.
+            content_range = response.content_range
+            response.response = ClosingIterator(
+                read_range(f, content_range.start, content_range.stop - content_range.start), f.close)
+    except Exception:
+        f.close()
+        raise
+    # The server closes the file wrapper of a passthrough body, not the
+    # response, so closing the file is what runs the response's callbacks
+    f.call_on_close(response.close)
+    return time_send(response)
+
+def media_etag(path, st):
+    return f"{media_store.path_digest(path)[:32]}-{st.st_size:x}-{int(st.st_mtime):x}"
+
+@app.route('/jobs/<job_id>/stream', methods=['GET'])
+def job_stream(job_id):
+    # Sends bytes while the download is still running when the job picked a
+    # format that needs no ffmpeg work; otherwise waits for the finished file.
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    source = open_source(job, partial_path, config.STREAM_WAIT_TIMEOUT)
+    if source is None:
+        if job.status == 'failed':
+            return jsonify({"error": job.error}), 400
+        return jsonify({"error": "Timed out waiting for download", "status": job.status}), 504
+
+    download_name = job.download_name or f"media.{job.format_type}"
+    logger.info("Streaming %s for job %s", source.name, job.id)
+    mimetype = 'audio/mpeg' if job.format_type == 'mp3' else 'video/mp4'
+    response = Response(follow(job, source), mimetype=mimetype, headers={
+        'Content-Disposition': content_disposition(download_name),
+    })
+    # A client that disconnects before the first chunk never starts the
+    # generator, so its cleanup wouldn't run; close the file here too
+    response.call_on_close(source.close)
+    metrics.label(platform=job.platform, format=job.format_type)
+    return time_send(response)
 
 if __name__ == '__main__':
+    # Development server only; see create_app() for production
     logger.info("Starting Flask app")
-    app.run(debug=True)
+    create_app().run(host=config.HOST, port=config.PORT, debug=config.DEBUG, threaded=True)
 
 
 #2nd video##################################################################################
@@ -0,0 +1,77 @@
+import logging
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from downloader import instagram_metadata, instagram_pool, youtube_metadata, youtube_pool
+from pools import PoolExhausted
+from urls import media_key, platform_of
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=config.BATCH_WORKERS, thread_name_prefix='batch-check')
+
+
+def check_urls(urls):
+    # Yields one result dict per input URL as soon as it resolves. URLs for the
+    # same media are resolved once. Each worker leases one Instaloader context
+    # or YoutubeDL instance and works through its platform's queue with it,
+    # so a batch reuses a handful of warm sessions instead of one per URL.
+    groups = {}
+    for index, url in enumerate(urls):
+        groups.setdefault(media_key(url), []).append((index, url))
+
+    tasks = {'instagram': queue.Queue(), 'youtube': queue.Queue()}
+    for items in groups.values():
+        tasks[platform_of(items[0][1])].put(items)
+
+    results = queue.Queue()
+    workers = {
+        'instagram': (instagram_worker, config.INSTAGRAM_CONCURRENCY),
+        'youtube': (youtube_worker, config.BATCH_WORKERS),
+    }
+    for platform, (worker, limit) in workers.items():
+        for _ in range(min(limit, tasks[platform].qsize())):
+            executor.submit(worker, tasks[platform], results)
+
+    for _ in range(len(groups)):
+        items, metadata, error = results.get()
+        for index, url in items:
+            if error is None:
+                yield dict(metadata, index=index, url=url)
+            else:
+                yield {"index": index, "url": url, "error": error}
+
+
+def drain(tasks, results, resolve):
+    while True:
+        try:
+            items = tasks.get(block=False)
+        except queue.Empty:
+            return
+        url = items[0][1]
+        try:
+            results.put((items, resolve(url), None))
+        except Exception as e:
+            logger.warning("Batch check failed for %s: %s", url, e)
+            results.put((items, None, str(e)))
+
+
+def fail(error):
+    def resolve(url):
+        raise error
+    return resolve
+
+
+def instagram_worker(tasks, results):
+    try:
+        with instagram_pool.lease(timeout=config.INSTAGRAM_LEASE_TIMEOUT) as L:
+            # Upstream requests are paced by the rate limiter, per session
+            drain(tasks, results, lambda url: instagram_metadata(L, url))
+    except PoolExhausted as e:
+        drain(tasks, results, fail(e))
+
+
+def youtube_worker(tasks, results):
+    with youtube_pool.lease('check') as ydl:
+        drain(tasks, results, lambda url: youtube_metadata(ydl, url))
@@ -0,0 +1,123 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    # In-process LRU cache whose entries also expire after `ttl` seconds. An
+    # optional backend (see SqliteBackend) is consulted on a memory miss and
+    # written through on set, so entries survive a restart.
+
+    def __init__(self, maxsize=1024, ttl=1800, backend=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+
+        if self.backend is not None:
+            entry = self.backend.get(key)
+            if entry is not None and entry[0] > now:
+                with self._lock:
+                    self._store(key, entry)
+                    self.hits += 1
+                return entry[1]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._store(key, (expires_at, value))
+        if self.backend is not None:
+            self.backend.set(key, expires_at, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+        if self.backend is not None:
+            self.backend.delete(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "persistent": self.backend is not None,
+            }
+
+    def _store(self, key, entry):
+        self._data[key] = entry
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class SqliteBackend:
+    # Values are stored as JSON, so only JSON-serializable values can be cached.
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache '
+                '(key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT NOT NULL)'
+            )
+        self.purge_expired()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT expires_at, value FROM cache WHERE key = ?', (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def set(self, key, expires_at, value):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache (key, expires_at, value) VALUES (?, ?, ?)',
+                (key, expires_at, json.dumps(value)),
+            )
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def purge_expired(self):
+        with self._lock, self._conn:
+            deleted = self._conn.execute(
+                'DELETE FROM cache WHERE expires_at <= ?', (time.time(),)
+            ).rowcount
+        if deleted:
+            logger.info("Purged %s expired entries from %s", deleted, self.path)
+        return deleted
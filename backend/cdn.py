@@ -0,0 +1,176 @@
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+
+# Total size in a Content-Range header: bytes 0-1023/146515
+RANGE_TOTAL = re.compile(r'/(\d+)$')
+
+# One connection pool for media fetched straight from CDN hosts. Their URLs
+# are signed, so no cookies or login are involved and any request thread can
+# share it.
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=config.CDN_POOL_SIZE, pool_maxsize=config.CDN_POOL_SIZE)
+session.mount('https://', _adapter)
+session.mount('http://', _adapter)
+
+
+def iter_content(url, timeout=config.CDN_TIMEOUT):
+    # Yields the body of `url` in CHUNK_SIZE pieces; raises for HTTP errors
+    with session.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        yield from response.iter_content(CHUNK_SIZE)
+
+
+def download(url, path, connections=config.CDN_CONNECTIONS, segment_size=config.CDN_SEGMENT_SIZE,
+             retries=config.CDN_SEGMENT_RETRIES, headers=None, progress=None, timeout=config.CDN_TIMEOUT):
+    # Writes the body of `url` to `path` and returns its size. With several
+    # connections the body is fetched `segment_size` bytes at a time over
+    # that many parallel Range requests, each writing at its own offset of a
+    # file allocated up front; a failed segment is retried from where it
+    # stopped. The first request asks for the first segment, so hosts that
+    # ignore Range just send the whole body in order, as a single connection
+    # does; such a file can be followed while it grows. `progress(downloaded,
+    # total)` is called as bytes arrive.
+    headers = dict(headers or {})
+    probe = dict(headers, Range=f'bytes=0-{segment_size - 1}') if connections > 1 else headers
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        with session.get(url, headers=probe, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                total = int(response.headers.get('Content-Length') or 0) or None
+                segment = _Segment(0, None)
+                _copy(fd, response, segment, _Progress(total, progress))
+                return segment.position
+            match = RANGE_TOTAL.search(response.headers.get('Content-Range', ''))
+            if match is None:
+                raise IOError(f"Range response without a total size: {response.headers.get('Content-Range')}")
+            total = int(match.group(1))
+            _allocate(fd, total)
+            segments = [_Segment(start, min(start + segment_size, total) - 1)
+                        for start in range(0, total, segment_size)]
+            logger.debug("Fetching %s bytes as %s segments over %s connections", total, len(segments), connections)
+            _SegmentedDownload(url, fd, headers, _Progress(total, progress), retries, timeout).run(
+                segments, response, connections)
+            return total
+    finally:
+        os.close(fd)
+
+
+def _allocate(fd, size):
+    # Reserves the blocks up front where the platform can, so parallel writes
+    # don't fragment the file; a sparse file of the right size otherwise
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, size)
+
+
+class _Progress:
+    def __init__(self, total, callback):
+        self.total = total
+        self.callback = callback
+        self.downloaded = 0
+        self._lock = threading.Lock()
+
+    def add(self, amount):
+        # Callbacks see a running total, one at a time
+        with self._lock:
+            self.downloaded += amount
+            if self.callback is not None:
+                self.callback(self.downloaded, self.total)
+
+
+class _Segment:
+    # Bytes start..end of the body (end None: to the end of the response);
+    # `position` is the next byte to write, so a retry resumes from there
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.position = start
+
+    @property
+    def done(self):
+        return self.end is not None and self.position > self.end
+
+
+def _copy(fd, response, segment, counter, cancelled=None):
+    for chunk in response.iter_content(CHUNK_SIZE):
+        if cancelled is not None and cancelled.is_set():
+            raise IOError("Cancelled")
+        if segment.end is not None:
+            chunk = chunk[:segment.end + 1 - segment.position]
+        view = memoryview(chunk)
+        while view:
+            count = os.pwrite(fd, view, segment.position)
+            view = view[count:]
+            segment.position += count
+            counter.add(count)
+        if segment.done:
+            return
+
+
+class _SegmentedDownload:
+    def __init__(self, url, fd, headers, counter, retries, timeout):
+        self.url = url
+        self.fd = fd
+        self.headers = headers
+        self.counter = counter
+        self.retries = retries
+        self.timeout = timeout
+        self.cancelled = threading.Event()
+
+    def run(self, segments, first_response, connections):
+        # The first segment is read from the probe's response; the others
+        # take their own requests. Any failure that outlives its retries
+        # stops the remaining segments.
+        with ThreadPoolExecutor(max_workers=connections, thread_name_prefix='cdn-segment') as executor:
+            futures = [executor.submit(self.fetch, segments[0], first_response)]
+            futures += [executor.submit(self.fetch, segment) for segment in segments[1:]]
+            try:
+                for future in futures:
+                    future.result()
+            except Exception:
+                self.cancelled.set()
+                raise
+
+    def fetch(self, segment, response=None):
+        attempt = 0
+        while True:
+            if self.cancelled.is_set():
+                return
+            position = segment.position
+            try:
+                if response is None:
+                    headers = dict(self.headers, Range=f'bytes={segment.position}-{segment.end}')
+                    response = session.get(self.url, headers=headers, stream=True, timeout=self.timeout)
+                with response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise IOError(f"Range request answered with {response.status_code}")
+                    _copy(self.fd, response, segment, self.counter, self.cancelled)
+                if not segment.done:
+                    raise IOError(f"Segment {segment.start}-{segment.end} ended at {segment.position}")
+                return
+            except Exception as e:
+                # Only attempts that got nowhere use up retries
+                attempt = 1 if segment.position > position else attempt + 1
+                if self.cancelled.is_set() or attempt > self.retries:
+                    raise
+                logger.warning("Segment %s-%s failed at %s (%s), retrying (attempt %s/%s)",
+                               segment.start, segment.end, segment.position, e, attempt, self.retries)
+                time.sleep(min(0.5 * 2 ** (attempt - 1), 5))
+            finally:
+                response = None
@@ -0,0 +1,147 @@
+import os
+
+# All tunables come from the environment so deployments don't need code edits.
+
+# Serving. DEBUG turns on Flask's debugger and reloader for `python app.py`
+# and must stay off anywhere reachable from outside. In production run
+# gunicorn with gunicorn.conf.py (see README). Jobs, progress streams and
+# pools live in the process, so it runs WEB_WORKERS=1 process with
+# WEB_THREADS threads; each SSE or streaming client holds one thread for as
+# long as it is connected. On shutdown, running downloads get DRAIN_TIMEOUT
+# seconds to finish.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+DEBUG = os.getenv('DEBUG', '').lower() in ('1', 'true', 'yes')
+HOST = os.getenv('HOST', '127.0.0.1')
+PORT = int(os.getenv('PORT', '5000'))
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', '1'))
+WEB_THREADS = int(os.getenv('WEB_THREADS', '64'))
+DRAIN_TIMEOUT = int(os.getenv('DRAIN_TIMEOUT', '300'))
+
+# Scratch space for downloads in progress; every fetch works in its own
+# subdirectory. Subdirectories older than SCRATCH_MAX_AGE that no running
+# fetch owns are removed every SCRATCH_SWEEP_INTERVAL seconds.
+DOWNLOAD_DIR = os.getenv('DOWNLOAD_DIR', 'downloads')
+SCRATCH_MAX_AGE = int(os.getenv('SCRATCH_MAX_AGE', str(6 * 3600)))
+SCRATCH_SWEEP_INTERVAL = int(os.getenv('SCRATCH_SWEEP_INTERVAL', '300'))
+# New downloads are refused (HTTP 507) while less than this is free on the
+# scratch filesystem
+SCRATCH_MIN_FREE_BYTES = int(os.getenv('SCRATCH_MIN_FREE_BYTES', str(2 * 1024 ** 3)))
+
+# Download jobs run off the request thread. DOWNLOAD_WORKERS bounds the pool and
+# the per-platform limits cap how many of those workers one extractor may hold.
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '4'))
+INSTAGRAM_CONCURRENCY = int(os.getenv('INSTAGRAM_CONCURRENCY', '2'))
+YOUTUBE_CONCURRENCY = int(os.getenv('YOUTUBE_CONCURRENCY', str(DOWNLOAD_WORKERS)))
+JOB_TTL = int(os.getenv('JOB_TTL', '3600'))
+
+# Extracted info dicts shared between /check and /download. YouTube stream URLs
+# expire after a few hours, so keep the TTL well below that. Set
+# METADATA_CACHE_PATH to a sqlite file to keep entries across restarts.
+METADATA_CACHE_TTL = int(os.getenv('METADATA_CACHE_TTL', '1800'))
+METADATA_CACHE_SIZE = int(os.getenv('METADATA_CACHE_SIZE', '1024'))
+METADATA_CACHE_PATH = os.getenv('METADATA_CACHE_PATH')
+
+# Finished media is kept in a content-addressed store so repeat requests are
+# served from disk. The least recently used files go once it passes the limit.
+MEDIA_STORE_DIR = os.getenv('MEDIA_STORE_DIR', 'media_store')
+MEDIA_STORE_MAX_BYTES = int(os.getenv('MEDIA_STORE_MAX_BYTES', str(10 * 1024 ** 3)))
+# Entries used within this many seconds are not evicted, so /media/<digest>
+# URLs handed out to clients stay valid long enough to resume a download
+MEDIA_GRACE_PERIOD = int(os.getenv('MEDIA_GRACE_PERIOD', '3600'))
+# Hand file bodies to a fronting nginx/Apache via X-Sendfile instead of
+# reading them through Python
+USE_X_SENDFILE = os.getenv('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+
+# How long GET /jobs/<id>/stream waits for a queued job to produce bytes
+STREAM_WAIT_TIMEOUT = int(os.getenv('STREAM_WAIT_TIMEOUT', '600'))
+
+# Pool of long-lived Instaloader contexts. INSTAGRAM_SESSIONS is a comma
+# separated list of `username` or `username=/path/to/session-file` entries
+# (created with `instaloader --login`); with sessions configured there is one
+# context per session, otherwise INSTAGRAM_POOL_SIZE anonymous ones.
+INSTAGRAM_POOL_SIZE = int(os.getenv('INSTAGRAM_POOL_SIZE', '4'))
+INSTAGRAM_SESSIONS = [
+    tuple(entry.split('=', 1)) if '=' in entry else (entry, None)
+    for entry in (part.strip() for part in os.getenv('INSTAGRAM_SESSIONS', '').split(','))
+    if entry
+]
+# Minimum seconds between upstream requests from one Instagram session (all
+# anonymous contexts count as one, since they share the server's IP)
+INSTAGRAM_MIN_INTERVAL = float(os.getenv('INSTAGRAM_MIN_INTERVAL', '1.0'))
+INSTAGRAM_LEASE_TIMEOUT = float(os.getenv('INSTAGRAM_LEASE_TIMEOUT', '60'))
+
+# Image and carousel posts are streamed as a zip of their items, fetched from
+# the CDN INSTAGRAM_ITEM_CONCURRENCY at a time. Each item buffers at most
+# INSTAGRAM_ITEM_BUFFER bytes ahead of the zip writer.
+INSTAGRAM_ITEM_CONCURRENCY = int(os.getenv('INSTAGRAM_ITEM_CONCURRENCY', '4'))
+INSTAGRAM_ITEM_BUFFER = int(os.getenv('INSTAGRAM_ITEM_BUFFER', str(8 * 1024 ** 2)))
+
+# Story and highlight lookups go through per-profile indexes kept this long.
+# Story URLs are signed and stories change through the day, so keep it short.
+STORY_INDEX_TTL = int(os.getenv('STORY_INDEX_TTL', '300'))
+STORY_INDEX_SIZE = int(os.getenv('STORY_INDEX_SIZE', '256'))
+
+# GET /profiles/<username>.zip archives at most PROFILE_ARCHIVE_MAX_POSTS
+# posts per call. The newest post archived per profile is remembered under
+# ARCHIVE_STATE_DIR, so the next call only includes newer posts.
+PROFILE_ARCHIVE_MAX_POSTS = int(os.getenv('PROFILE_ARCHIVE_MAX_POSTS', '1000'))
+ARCHIVE_STATE_DIR = os.getenv('ARCHIVE_STATE_DIR', 'archive_state')
+
+# Media fetched straight from CDNs shares one keep-alive session: connections
+# kept per host, and the connect/read timeout in seconds
+CDN_POOL_SIZE = int(os.getenv('CDN_POOL_SIZE', '16'))
+CDN_TIMEOUT = float(os.getenv('CDN_TIMEOUT', '30'))
+# Hosts that accept Range requests are fetched CDN_SEGMENT_SIZE bytes at a
+# time over CDN_CONNECTIONS parallel connections, a failed segment retried up
+# to CDN_SEGMENT_RETRIES times; 1 connection fetches in one request.
+# YOUTUBE_SEGMENTED hands yt-dlp's plain http(s) downloads to the same
+# downloader instead of yt-dlp's single connection.
+CDN_CONNECTIONS = int(os.getenv('CDN_CONNECTIONS', '4'))
+CDN_SEGMENT_SIZE = int(os.getenv('CDN_SEGMENT_SIZE', str(4 * 1024 ** 2)))
+CDN_SEGMENT_RETRIES = int(os.getenv('CDN_SEGMENT_RETRIES', '3'))
+YOUTUBE_SEGMENTED = os.getenv('YOUTUBE_SEGMENTED', '').lower() in ('1', 'true', 'yes')
+
+# Idle YoutubeDL instances kept per option profile (check, mp4, mp3). 0 turns
+# pooling off and builds an instance per request.
+YTDL_POOL_SIZE = int(os.getenv('YTDL_POOL_SIZE', '2'))
+
+# POST /check/batch: URLs accepted per call and threads resolving them, shared
+# by all batches. Instagram items additionally stay within INSTAGRAM_CONCURRENCY.
+BATCH_MAX_URLS = int(os.getenv('BATCH_MAX_URLS', '500'))
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', '8'))
+
+# Parallel fragment fetches for DASH/HLS downloads
+FRAGMENT_CONCURRENCY = int(os.getenv('FRAGMENT_CONCURRENCY', '4'))
+
+# Most entries one POST /download/playlist call expands
+PLAYLIST_MAX_ENTRIES = int(os.getenv('PLAYLIST_MAX_ENTRIES', '500'))
+
+# Minimum seconds between progress events on a job's event stream, and the
+# idle time after which the SSE stream sends a keep-alive comment
+PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', '0.5'))
+SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', '15'))
+
+# Upstream token buckets: sustained requests per second and burst, per
+# platform. After a 429/403 a bucket backs off exponentially (with jitter)
+# from RATE_LIMIT_BACKOFF_BASE up to RATE_LIMIT_BACKOFF_MAX seconds. Requests
+# that would wait longer than RATE_LIMIT_MAX_WAIT fail with a 429; download
+# jobs instead wait it out up to RATE_LIMIT_RETRIES times.
+INSTAGRAM_RATE = float(os.getenv('INSTAGRAM_RATE', '0.5'))
+INSTAGRAM_BURST = int(os.getenv('INSTAGRAM_BURST', '3'))
+YOUTUBE_RATE = float(os.getenv('YOUTUBE_RATE', '2'))
+YOUTUBE_BURST = int(os.getenv('YOUTUBE_BURST', '5'))
+RATE_LIMIT_BACKOFF_BASE = float(os.getenv('RATE_LIMIT_BACKOFF_BASE', '30'))
+RATE_LIMIT_BACKOFF_MAX = float(os.getenv('RATE_LIMIT_BACKOFF_MAX', '900'))
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '30'))
+RATE_LIMIT_RETRIES = int(os.getenv('RATE_LIMIT_RETRIES', '5'))
+
+# Negative cache: how long a failed lookup is answered from memory, by the
+# kind of failure. 0 disables caching for that kind.
+NEGATIVE_CACHE_SIZE = int(os.getenv('NEGATIVE_CACHE_SIZE', '4096'))
+NEGATIVE_CACHE_TTLS = {
+    'not_found': int(os.getenv('NEGATIVE_TTL_NOT_FOUND', '3600')),
+    'unsupported': int(os.getenv('NEGATIVE_TTL_UNSUPPORTED', '21600')),
+    'geo_blocked': int(os.getenv('NEGATIVE_TTL_GEO_BLOCKED', '3600')),
+    'private': int(os.getenv('NEGATIVE_TTL_PRIVATE', '600')),
+    'throttled': int(os.getenv('NEGATIVE_TTL_THROTTLED', '30')),
+}
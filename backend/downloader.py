@@ -0,0 +1,534 @@
+import copy
+import itertools
+import logging
+import os
+import threading
+import time
+
+import instaloader
+import yt_dlp
+from yt_dlp.utils import PagedList
+
+import config
+import metrics
+from cache import SqliteBackend, TTLCache
+import cdn
+from failures import MediaUnavailable, NegativeCache
+from pools import InstaloaderPool, YoutubeDLPool
+from postprocess import plan_postprocessing, selected_formats
+from posts import POST_TYPES
+from ratelimit import RateLimiter, is_throttled
+from scratch import ScratchSpace
+from segmented import SEGMENTED
+from singleflight import SingleFlight
+from stories import StoryIndex
+from store import MediaStore
+from urls import classify, media_key, story_owner
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_DIR = config.DOWNLOAD_DIR
+
+metadata_cache = TTLCache(
+    maxsize=config.METADATA_CACHE_SIZE,
+    ttl=config.METADATA_CACHE_TTL,
+    backend=SqliteBackend(config.METADATA_CACHE_PATH) if config.METADATA_CACHE_PATH else None,
+)
+
+negative_cache = NegativeCache(config.NEGATIVE_CACHE_TTLS, maxsize=config.NEGATIVE_CACHE_SIZE)
+
+media_store = MediaStore(config.MEDIA_STORE_DIR, config.MEDIA_STORE_MAX_BYTES, grace_period=config.MEDIA_GRACE_PERIOD)
+scratch = ScratchSpace(DOWNLOAD_DIR, max_age=config.SCRATCH_MAX_AGE, min_free_bytes=config.SCRATCH_MIN_FREE_BYTES)
+
+instagram_pool = InstaloaderPool(size=config.INSTAGRAM_POOL_SIZE, sessions=config.INSTAGRAM_SESSIONS)
+
+# Every upstream request takes a token from its platform's bucket, and
+# Instagram requests also from their session's bucket.
+rate_limiter = RateLimiter(base_backoff=config.RATE_LIMIT_BACKOFF_BASE, max_backoff=config.RATE_LIMIT_BACKOFF_MAX)
+rate_limiter.configure('instagram', config.INSTAGRAM_RATE, config.INSTAGRAM_BURST)
+rate_limiter.configure('youtube', config.YOUTUBE_RATE, config.YOUTUBE_BURST)
+for session in ['anonymous'] + [username for username, _ in config.INSTAGRAM_SESSIONS]:
+    rate_limiter.configure(f'instagram:{session}', 1 / config.INSTAGRAM_MIN_INTERVAL)
+
+extractions_in_flight = SingleFlight('metadata extraction')
+downloads_in_flight = SingleFlight('download')
+
+# Store key -> temp file a streamable download is currently writing to
+partial_files = {}
+
+# Store key -> jobs waiting on that download. Progress from the one running
+# fetch fans out to every job coalesced onto it.
+progress_listeners = {}
+progress_lock = threading.Lock()
+
+# yt-dlp postprocessor keys -> job phase
+POSTPROCESSOR_PHASES = {
+    'Merger': 'merge',
+    'VideoRemuxer': 'remux',
+    'VideoConvertor': 'transcode',
+    'ExtractAudio': 'transcode',
+}
+
+# Quality baked into each format's yt-dlp options; part of the store key so a
+# change of options doesn't serve stale renditions.
+FORMAT_QUALITY = {
+    'mp4': 'best',
+    'mp3': '192',
+}
+
+
+class DownloadError(Exception):
+    pass
+
+
+def get_instagram_post(L, url):
+    key = media_key(url)
+    data = metadata_cache.get(key)
+    if data is not None:
+        logger.info("Metadata cache hit: %s", key)
+    else:
+        with negative_cache.guard(key):
+            data = extractions_in_flight.do(key, extract_instagram_post, L, url, key)
+    return instaloader.load_structure(L.context, copy.deepcopy(data))
+
+
+def extract_instagram_post(L, url, key):
+    with metrics.span('extract'), instagram_limit(L):
+        post = instaloader.Post.from_shortcode(L.context, classify(url).id)
+        data = instaloader.get_json_structure(post)
+    metadata_cache.set(key, data)
+    return data
+
+
+def get_youtube_info(url, ydl=None):
+    # Returns the unprocessed info dict; callers run it through their own
+    # YoutubeDL.process_ie_result() so format selection follows their options.
+    # A copy is returned because processing mutates the dict in place. Callers
+    # already holding a 'check' lease pass it as `ydl` rather than have a
+    # cache miss lease a second instance.
+    key = media_key(url)
+    info = metadata_cache.get(key)
+    if info is not None:
+        logger.info("Metadata cache hit: %s", key)
+    else:
+        with negative_cache.guard(key):
+            info = extractions_in_flight.do(key, extract_youtube_info, url, key, ydl)
+    return copy.deepcopy(info)
+
+
+def extract_youtube_info(url, key, ydl=None):
+    if ydl is None:
+        with youtube_pool.lease('check') as ydl:
+            return extract_youtube_info(url, key, ydl)
+    with metrics.span('extract'), youtube_limit():
+        info = ydl.sanitize_info(bounded_entries(ydl.extract_info(url, download=False, process=False)))
+    metadata_cache.set(key, info)
+    return info
+
+
+def bounded_entries(info, limit=config.PLAYLIST_MAX_ENTRIES):
+    # Playlist and channel results carry their entries as a generator or a
+    # PagedList, which sanitize_info would turn into a string; up to `limit`
+    # of them are kept as a list instead, so the result can be cached
+    entries = info.get('entries')
+    if entries is None or isinstance(entries, list):
+        return info
+    if isinstance(entries, PagedList):
+        entries = entries.getslice(0, limit)
+    else:
+        entries = list(itertools.islice(entries, limit))
+    return dict(info, entries=entries)
+
+
+def instagram_limit(L, timeout=config.RATE_LIMIT_MAX_WAIT):
+    # Anonymous contexts share the server's IP, so they share a bucket too
+    return rate_limiter.guard(('instagram', f"instagram:{L.context.username or 'anonymous'}"), timeout)
+
+
+def youtube_limit(timeout=config.RATE_LIMIT_MAX_WAIT):
+    return rate_limiter.guard(('youtube',), timeout)
+
+
+story_index = StoryIndex(instagram_limit, ttl=config.STORY_INDEX_TTL, maxsize=config.STORY_INDEX_SIZE)
+
+
+def get_story_item(L, url):
+    ref = classify(url)
+    with negative_cache.guard(media_key(url)):
+        return story_index.story(L, story_owner(url), int(ref.id))
+
+
+def get_highlight(L, url):
+    # Returns (owner username, title, items)
+    with negative_cache.guard(media_key(url)):
+        return story_index.highlight(L, int(classify(url).id))
+
+
+def get_profile(L, url):
+    with negative_cache.guard(media_key(url)):
+        return story_index.profile(L, classify(url).id)
+
+
+def instagram_metadata(L, url):
+    kind = classify(url).kind
+    if kind == 'story':
+        username = story_owner(url)
+        item = get_story_item(L, url)
+        return {
+            "title": f"Story by {username}",
+            "duration": item.video_duration if item.is_video else 0,
+            "thumbnail": item.url,
+            "quality": "HD",
+            "type": 'video' if item.is_video else 'image',
+            "items": 1,
+        }
+    if kind == 'highlight':
+        username, title, items = get_highlight(L, url)
+        return {
+            "title": title or f"Highlight by {username}",
+            "duration": sum(item.video_duration or 0 for item in items if item.is_video),
+            "thumbnail": items[0].url,
+            "quality": "HD",
+            "type": 'highlight',
+            "items": len(items),
+        }
+    if kind == 'profile':
+        profile = get_profile(L, url)
+        return {
+            "title": f"{profile.full_name} (@{profile.username})" if profile.full_name else f"@{profile.username}",
+            "duration": 0,
+            "thumbnail": profile.profile_pic_url,
+            "quality": "HD",
+            "type": 'profile',
+            "items": profile.mediacount,
+        }
+    if kind != 'post':
+        raise DownloadError("Only Instagram posts, reels, stories, highlights and profiles are supported")
+    post = get_instagram_post(L, url)
+    return {
+        "title": post.caption or 'Instagram Post',
+        "duration": post.video_duration if post.is_video else 0,
+        "thumbnail": post.url if not post.is_video else post.video_url,
+        "quality": "HD",
+        "type": POST_TYPES.get(post.typename, 'image'),
+        "items": post.mediacount,
+    }
+
+
+def youtube_metadata(ydl, url):
+    # `ydl` is a lease of the 'check' profile from youtube_pool
+    info = ydl.process_ie_result(get_youtube_info(url, ydl), download=False)
+    return {
+        "title": info.get('title', 'Unknown Title'),
+        "duration": info.get('duration', 0),
+        "thumbnail": info.get('thumbnail', ''),
+        "quality": info.get('resolution', 'Unknown Quality'),
+    }
+
+
+def store_key(url, format_type):
+    # Instagram media is always delivered as the original mp4
+    if classify(url).platform == 'instagram':
+        format_type = 'mp4'
+    return (media_key(url), format_type, FORMAT_QUALITY.get(format_type, 'best'))
+
+
+def progressive_format(info):
+    # Best single-file mp4 with both audio and video over plain HTTP. Such a
+    # format needs neither a merge nor a transcode, so it can be streamed to
+    # the client while it downloads.
+    candidates = [
+        f for f in info.get('formats') or []
+        if f.get('ext') == 'mp4'
+        and f.get('vcodec') not in (None, 'none')
+        and f.get('acodec') not in (None, 'none')
+        and f.get('protocol') in (None, 'http', 'https')
+    ]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda f: (f.get('height') or 0, f.get('tbr') or 0))
+
+
+def partial_path(job):
+    return partial_files.get(job.stream_key)
+
+
+def enqueue_download(job_manager, job, on_done=None):
+    stored = media_store.get(store_key(job.url, job.format_type))
+    if stored is not None:
+        # Already in the media store: no need to queue behind other downloads
+        logger.info("Serving %s from media store: %s", job.url, stored.path)
+        job.postprocess = 'cached'
+        return job_manager.complete(job, stored.path, stored.download_name, on_done)
+    # Refuse up front rather than accept a job that can't fit
+    scratch.check_room()
+    job_manager.submit(job, download_media, on_done)
+    logger.info("Queued download job %s", job.id)
+    return job
+
+
+def download_media(job):
+    key = store_key(job.url, job.format_type)
+    fmt = None
+    if job.stream and job.platform == 'youtube' and job.format_type == 'mp4':
+        info = get_youtube_info(job.url)
+        fmt = progressive_format(info)
+        if fmt is not None:
+            key = (key[0], 'mp4', 'progressive')
+            job.stream_key = key
+            job.download_name = f"{info.get('title', 'media')}.mp4"
+        else:
+            logger.info("No progressive mp4 for %s, streaming falls back to the finished file", job.url)
+    elif job.stream and job.platform == 'instagram':
+        # Fetched from the CDN in order, so it can be followed as it arrives
+        job.stream_key = key
+
+    stored = media_store.get(key)
+    if stored is None:
+        with progress_lock:
+            progress_listeners.setdefault(key, set()).add(job)
+        try:
+            # Concurrent jobs for the same media share one fetch/transcode
+            stored = downloads_in_flight.do(key, fetch_media, job, key, fmt)
+        finally:
+            with progress_lock:
+                listeners = progress_listeners.get(key)
+                listeners.discard(job)
+                if not listeners:
+                    del progress_listeners[key]
+        job.postprocess = stored.meta.get('postprocess')
+    else:
+        logger.info("Media store hit: %s", key)
+        job.postprocess = 'cached'
+    return stored.path, stored.download_name
+
+
+def fetch_media(job, key, fmt=None):
+    # A flight that finished just before this one started has already
+    # published the file.
+    stored = media_store.get(key)
+    if stored is not None:
+        return stored
+
+    # Throttling is waited out rather than failing the job; the limiter has
+    # already backed the buckets off, so the next attempt starts after that.
+    # A throttled lookup remembered by the negative cache is waited out until
+    # the entry expires; upstream wasn't asked, so that isn't an attempt.
+    attempt = 0
+    while True:
+        try:
+            return fetch_once(job, key, fmt)
+        except Exception as e:
+            cached = isinstance(e, MediaUnavailable)
+            if not (e.reason == 'throttled' if cached else is_throttled(e)):
+                raise
+            if not cached:
+                attempt += 1
+            if attempt > config.RATE_LIMIT_RETRIES:
+                raise
+            delay = max(getattr(e, 'retry_after', 0), rate_limiter.blocked_for((job.platform,)), 1.0)
+            logger.warning("Download of %s throttled (%s), retrying in %.1fs (attempt %s/%s)",
+                           job.url, e, delay, attempt, config.RATE_LIMIT_RETRIES)
+            report_progress(key, phase='waiting', retry_after=round(delay, 1))
+            with metrics.span('waiting'):
+                time.sleep(delay)
+
+
+def fetch_once(job, key, fmt):
+    # Downloads fail for reasons a metadata lookup doesn't (image posts,
+    # geo-blocked streams), so they are remembered under their own key.
+    # Throttling isn't: fetch_media waits it out and tries again.
+    guard = negative_cache.guard(f"download:{media_key(job.url)}", skip=('throttled',))
+    with guard, scratch.directory(job.id) as workdir:
+        if job.platform == 'instagram':
+            file_path, download_name, plan = download_instagram(job.url, key, workdir, stream=job.stream)
+        elif fmt is not None:
+            file_path, download_name, plan = download_youtube_progressive(job.url, fmt, key, workdir)
+        else:
+            file_path, download_name, plan = download_youtube(job.url, job.format_type, key, workdir)
+
+        return media_store.publish(key, file_path, download_name, meta={'postprocess': plan})
+
+
+def download_instagram(url, key, workdir, stream=False):
+    ref = classify(url)
+    if ref.kind not in ('post', 'story'):
+        # Highlights are streamed as a zip, see app.highlight_archive
+        raise DownloadError("Only Instagram posts, reels and stories are supported as single files")
+
+    with instagram_pool.lease(timeout=config.INSTAGRAM_LEASE_TIMEOUT) as L:
+        if ref.kind == 'story':
+            # The story index already holds the item's CDN URL
+            item = get_story_item(L, url)
+            media_url = item.video_url if item.is_video else item.url
+            ext = 'mp4' if item.is_video else 'jpg'
+            name = f"{item.mediaid}.{ext}"
+            download_name = f"{story_owner(url)}_story_{item.mediaid}.{ext}"
+        else:
+            post = get_instagram_post(L, url)
+            if not post.is_video or post.typename == 'GraphSidecar':
+                # Those are streamed as a zip instead, see posts.post_zip
+                raise DownloadError("Only video posts are supported; image and carousel posts download as a zip")
+            media_url = post.video_url
+            name = f"{post.shortcode}.mp4"
+            download_name = f"{post.owner_username}_{ref.id}.mp4"
+
+    # Straight from the CDN: no captions, metadata or thumbnails written
+    # alongside, and no Instagram request beyond the metadata lookup. A job
+    # streaming the file as it arrives needs it written in order.
+    file_path = os.path.join(workdir, name)
+    on_progress = progress_hooks(key)['progress_hooks'][0]
+
+    def progress(downloaded, total):
+        on_progress({'status': 'downloading', 'downloaded_bytes': downloaded, 'total_bytes': total})
+
+    if stream:
+        partial_files[key] = file_path
+    try:
+        with metrics.span('download'):
+            size = cdn.download(media_url, file_path, connections=1 if stream else config.CDN_CONNECTIONS,
+                                progress=progress)
+    finally:
+        partial_files.pop(key, None)
+
+    logger.info("Instagram file size: %s bytes", size)
+    return file_path, download_name, 'none'
+
+
+def youtube_options(format_type, workdir=DOWNLOAD_DIR):
+    # Format selection only; postprocessing is planned per download once the
+    # selected formats' codecs are known. Files are named by video id; the
+    # title is only used for the download name.
+    options = {
+        'outtmpl': f'{workdir}/%(id)s.%(ext)s',
+        'noplaylist': True,
+        'concurrent_fragment_downloads': config.FRAGMENT_CONCURRENCY,
+    }
+    if config.YOUTUBE_SEGMENTED:
+        # Plain http(s) formats over parallel Range requests (see segmented.py)
+        options['external_downloader'] = {'http': SEGMENTED}
+
+    if format_type == 'mp4':
+        options['format'] = 'bestvideo[vcodec^=avc1][ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/bestvideo+bestaudio/best'
+    else:  # MP3
+        options['format'] = 'bestaudio[ext=m4a]/bestaudio'
+    return options
+
+
+# Extraction and format selection run on pooled instances. Downloads still get
+# their own YoutubeDL since postprocessors and hooks differ per job.
+youtube_pool = YoutubeDLPool({
+    'check': {'format': 'best', 'noplaylist': True, 'quiet': True},
+    'mp4': dict(youtube_options('mp4'), quiet=True),
+    'mp3': dict(youtube_options('mp3'), quiet=True),
+}, size=config.YTDL_POOL_SIZE)
+
+
+def report_progress(key, throttle=False, **fields):
+    with progress_lock:
+        jobs = list(progress_listeners.get(key, ()))
+    for job in jobs:
+        job.report(throttle=throttle, **fields)
+
+
+def progress_hooks(key, expected_bytes=None):
+    # yt-dlp hooks feeding the jobs listening on `key`. A merge downloads its
+    # parts one after another; with the parts' sizes known up front (from
+    # the selected formats) progress is reported across the whole job,
+    # otherwise per part. They also time the download and each postprocessor
+    # into the fetching job's timings; fragment downloads may call them from
+    # other threads, so those are captured here.
+    completed = [0]
+    timings = metrics.current() or metrics.Timings()
+    postprocess_started = {}
+
+    def on_progress(d):
+        if d['status'] == 'downloading':
+            part_total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            if expected_bytes:
+                downloaded, total = completed[0] + (d.get('downloaded_bytes') or 0), expected_bytes
+            else:
+                downloaded, total = d.get('downloaded_bytes') or 0, part_total
+            report_progress(
+                key, throttle=True, phase='fetch',
+                downloaded_bytes=downloaded, total_bytes=total,
+                speed=d.get('speed'), eta=d.get('eta'),
+                percent=min(round(100 * downloaded / total, 1), 99.9) if total else None,
+            )
+        elif d['status'] == 'finished':
+            completed[0] += d.get('total_bytes') or d.get('downloaded_bytes') or 0
+            if d.get('elapsed'):
+                timings.record('download', d['elapsed'])
+
+    def on_postprocess(d):
+        phase = POSTPROCESSOR_PHASES.get(d.get('postprocessor'))
+        if not phase:
+            return
+        if d['status'] == 'started':
+            postprocess_started[phase] = time.perf_counter()
+            report_progress(key, phase=phase, speed=None, eta=None)
+        elif d['status'] == 'finished' and phase in postprocess_started:
+            timings.record(phase, time.perf_counter() - postprocess_started.pop(phase))
+
+    return {'progress_hooks': [on_progress], 'postprocessor_hooks': [on_postprocess]}
+
+
+def expected_size(formats):
+    sizes = [f.get('filesize') or f.get('filesize_approx') for f in formats]
+    return sum(sizes) if sizes and all(sizes) else None
+
+
+def download_youtube(url, format_type, key, workdir):
+    options = youtube_options(format_type, workdir)
+    with youtube_pool.lease(format_type) as ydl:
+        selected = ydl.process_ie_result(get_youtube_info(url), download=False)
+    plan, postprocess_options = plan_postprocessing(selected, format_type)
+    # Pin the formats the plan was made for
+    options.update(postprocess_options, format=selected['format_id'])
+    options.update(progress_hooks(key, expected_size(selected_formats(selected))))
+
+    logger.debug("yt-dlp format %s, postprocessors %s", options['format'],
+                 [pp['key'] for pp in options.get('postprocessors', ())])
+    with yt_dlp.YoutubeDL(options) as ydl, youtube_limit():
+        logger.info("Starting download for URL: %s", url)
+        info = ydl.process_ie_result(get_youtube_info(url), download=True)
+        file_path = ydl.prepare_filename(info)
+        if format_type == 'mp4' and not file_path.endswith('.mp4'):
+            file_path = file_path.rsplit('.', 1)[0] + '.mp4'
+        elif format_type == 'mp3':
+            file_path = file_path.rsplit('.', 1)[0] + '.mp3'
+        logger.info("Download completed. File path: %s", file_path)
+
+    if not os.path.exists(file_path):
+        logger.error("File not found at %s after download", file_path)
+        raise DownloadError("File not downloaded")
+
+    logger.info("File size: %s bytes", os.path.getsize(file_path))
+    return file_path, f"{info.get('title', 'media')}.{format_type}", plan
+
+
+def download_youtube_progressive(url, fmt, key, workdir):
+    def track_partial_file(d):
+        if d['status'] == 'downloading' and d.get('tmpfilename'):
+            partial_files[key] = d['tmpfilename']
+
+    hooks = progress_hooks(key, expected_size([fmt]))
+    options = {
+        'outtmpl': f'{workdir}/%(id)s.%(ext)s',
+        'noplaylist': True,
+        'format': fmt['format_id'],
+        'progress_hooks': [track_partial_file] + hooks['progress_hooks'],
+    }
+    info = get_youtube_info(url)
+    try:
+        with yt_dlp.YoutubeDL(options) as ydl, youtube_limit():
+            logger.info("Starting streamable download for URL: %s (format %s)", url, fmt['format_id'])
+            info = ydl.process_ie_result(info, download=True)
+            file_path = ydl.prepare_filename(info)
+    finally:
+        partial_files.pop(key, None)
+
+    if not os.path.exists(file_path):
+        logger.error("File not found at %s after download", file_path)
+        raise DownloadError("File not downloaded")
+    return file_path, f"{info.get('title', 'media')}.mp4", 'none'
@@ -0,0 +1,47 @@
+import threading
+import time
+from collections import deque
+
+
+class EventChannel:
+    # Ordered, bounded buffer of events for one job. Subscribers remember the
+    # last sequence number they saw and block until something newer arrives.
+    # Progress events are snapshots, so a slow subscriber that falls out of
+    # the buffer just resumes from the oldest event still held.
+
+    def __init__(self, min_interval=0.5, maxlen=100):
+        self.min_interval = min_interval
+        self.closed = False
+        self._events = deque(maxlen=maxlen)
+        self._seq = 0
+        self._last_throttled = 0.0
+        self._cond = threading.Condition()
+
+    def publish(self, event, throttle=False):
+        # Throttled events are dropped if one went out less than
+        # min_interval ago; use it for high-frequency progress updates.
+        with self._cond:
+            if self.closed:
+                return False
+            now = time.monotonic()
+            if throttle:
+                if now - self._last_throttled < self.min_interval:
+                    return False
+                self._last_throttled = now
+            self._seq += 1
+            self._events.append(dict(event, seq=self._seq))
+            self._cond.notify_all()
+            return True
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def wait(self, after=0, timeout=None):
+        # Returns events with seq > after, waiting up to `timeout` seconds for
+        # one to arrive. An empty list means timeout or a closed channel.
+        with self._cond:
+            self._cond.wait_for(lambda: self.closed or (self._events and self._events[-1]['seq'] > after),
+                                timeout=timeout)
+            return [event for event in self._events if event['seq'] > after]
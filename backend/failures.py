@@ -0,0 +1,97 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from cache import TTLCache
+from ratelimit import RateLimited, is_throttled
+
+logger = logging.getLogger(__name__)
+
+# (reason, exception class names, message substrings), first match wins.
+# Instaloader reports most failures through exception classes; yt-dlp wraps
+# everything in DownloadError, so its reasons come from the message.
+FAILURE_REASONS = [
+    ('not_found',
+     ('QueryReturnedNotFoundException', 'ProfileNotExistsException', 'StoryNotFound'),
+     ('Video unavailable', 'This video has been removed', 'does not exist', 'HTTP Error 404',
+      'This video is no longer available', 'account associated with this video has been terminated',
+      # Instaloader's BadResponseException for a deleted or private post
+      'Fetching Post metadata failed')),
+    ('private',
+     ('LoginRequiredException', 'PrivateProfileNotFollowedException'),
+     ('Private video', 'Sign in to confirm your age', 'members-only', 'login required')),
+    ('geo_blocked',
+     (),
+     ('not available in your country', 'geo restriction', 'geo-restricted', 'blocked it in your country')),
+    ('unsupported',
+     ('UnsupportedError',),
+     ('Unsupported URL', 'Only video posts are supported', 'Only Instagram posts')),
+]
+
+
+class MediaUnavailable(Exception):
+    # A failure answered from the negative cache rather than upstream;
+    # `retry_after` is how long until the entry expires
+    def __init__(self, message, reason, retry_after=0):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def failure_reason(error):
+    # Returns the reason a failure is worth remembering for, or None for
+    # errors that say nothing lasting about the URL (network blips, ffmpeg).
+    if isinstance(error, MediaUnavailable):
+        return error.reason
+    if isinstance(error, RateLimited):
+        # Our own limiter said no; upstream was never asked
+        return None
+    name = type(error).__name__
+    text = str(error)
+    for reason, class_names, markers in FAILURE_REASONS:
+        if name in class_names or any(marker in text for marker in markers):
+            return reason
+    # Checked last: a permanent answer outranks throttling wording in the
+    # same message, and is cached for much longer
+    if is_throttled(error):
+        return 'throttled'
+    return None
+
+
+class NegativeCache:
+    # Remembers why a media key failed, for a TTL that depends on the reason:
+    # long for permanent answers (deleted, unsupported), short for throttling.
+    # Lookups for a remembered key fail straight away with MediaUnavailable,
+    # without touching Instaloader or yt-dlp.
+
+    def __init__(self, ttls, maxsize=4096):
+        self.ttls = ttls
+        self.rejections = {reason: 0 for reason in ttls}
+        self._cache = TTLCache(maxsize=maxsize, ttl=max(ttls.values(), default=0))
+
+    def check(self, key):
+        entry = self._cache.get(key)
+        if entry is not None:
+            self.rejections[entry["reason"]] = self.rejections.get(entry["reason"], 0) + 1
+            raise MediaUnavailable(entry["error"], entry["reason"], max(entry["expires"] - time.time(), 0))
+
+    def remember(self, key, error, skip=()):
+        reason = failure_reason(error)
+        ttl = self.ttls.get(reason)
+        if not ttl or reason in skip or isinstance(error, MediaUnavailable):
+            return
+        logger.info("Remembering %s failure for %s for %ss: %s", reason, key, ttl, error)
+        self._cache.set(key, {"reason": reason, "error": str(error), "expires": time.time() + ttl}, ttl=ttl)
+
+    @contextmanager
+    def guard(self, key, skip=()):
+        # Failures whose reason is in `skip` are not remembered
+        self.check(key)
+        try:
+            yield
+        except Exception as e:
+            self.remember(key, e, skip)
+            raise
+
+    def stats(self):
+        return dict(self._cache.stats(), ttls=self.ttls, rejections=dict(self.rejections))
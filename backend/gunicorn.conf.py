@@ -0,0 +1,36 @@
+# Production settings for `gunicorn -c gunicorn.conf.py "app:create_app()"`,
+# run from backend/. Everything is read from the same environment variables
+# as config.py, imported under another name: gunicorn takes every top-level
+# name in this file as a setting, and `config` is one of them.
+import os
+
+import config as app_config
+
+bind = os.getenv('BIND', f'{app_config.HOST}:{app_config.PORT}')
+
+# Downloads run on the app's own thread pool, but progress streams, file
+# sends and /check calls hold a request thread while they wait on the network,
+# so requests are served by threads rather than processes. Job state lives in
+# the process: keep one worker unless requests are pinned to workers by a
+# sticky load balancer.
+worker_class = 'gthread'
+workers = app_config.WEB_WORKERS
+threads = app_config.WEB_THREADS
+
+# Heartbeat timeout for the worker process, not a per-request limit; long
+# downloads and SSE streams are fine.
+timeout = 120
+keepalive = 5
+
+# SIGTERM: in-flight requests finish, then worker_exit drains download jobs.
+# Gunicorn kills the worker graceful_timeout seconds after the signal, so it
+# must cover the drain.
+graceful_timeout = app_config.DRAIN_TIMEOUT + 30
+
+loglevel = app_config.LOG_LEVEL.lower()
+accesslog = '-'
+
+
+def worker_exit(server, worker):
+    from app import shutdown
+    shutdown()
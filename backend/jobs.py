@@ -0,0 +1,241 @@
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import metrics
+from events import EventChannel
+from failures import MediaUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, url, format_type, platform, stream=False):
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.format_type = format_type
+        self.platform = platform
+        self.stream = stream
+        self.stream_key = None
+        self.postprocess = None
+        self.status = 'queued'
+        self.error = None
+        self.file_path = None
+        self.download_name = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.timings = metrics.Timings(platform=platform, format=format_type)
+        self.progress = {"status": self.status, "phase": 'queued'}
+        self.events = EventChannel(min_interval=config.PROGRESS_INTERVAL)
+        self.events.publish(self.progress)
+
+    @property
+    def done(self):
+        return self.status in ('finished', 'failed')
+
+    def report(self, throttle=False, **fields):
+        # Updates the progress snapshot and publishes it to the job's event
+        # channel. Phases: queued, fetch, merge, remux, transcode, done.
+        self.progress = dict(self.progress, status=self.status, **fields)
+        self.events.publish(self.progress, throttle=throttle)
+
+    def settle(self):
+        # Final event for a finished or failed job; closes the channel
+        if self.status == 'finished':
+            self.report(phase='done', percent=100)
+        else:
+            self.report(phase='done', error=self.error)
+        self.events.close()
+        self.timings.finish()
+        metrics.jobs_total.inc(platform=self.platform, format=metrics.format_label(self.format_type),
+                               status='cached' if self.postprocess == 'cached' else self.status)
+        logger.info("Job %s timings: %s", self.id, self.timings)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "url": self.url,
+            "format": self.format_type,
+            "platform": self.platform,
+            "stream": self.stream,
+            "postprocess": self.postprocess,
+            "status": self.status,
+            "error": self.error,
+            "download_name": self.download_name,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress,
+            "timings": self.timings.to_dict(),
+        }
+
+
+class ShuttingDown(Exception):
+    pass
+
+
+class JobManager:
+    # Runs download jobs on a bounded thread pool. Each platform gets its own
+    # concurrency cap; jobs over the cap wait in a per-platform queue instead
+    # of blocking a worker thread, so one slow extractor can't starve the rest.
+
+    def __init__(self, workers=4, platform_limits=None, job_ttl=3600):
+        self.workers = workers
+        self.platform_limits = dict(platform_limits or {})
+        self.job_ttl = job_ttl
+        self.draining = False
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='download')
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._jobs = {}
+        self._pending = {}
+        self._running = {}
+        # Futures of jobs handed to the executor, until their _run returns
+        self._futures = {}
+
+    def submit(self, job, fn, on_done=None):
+        # on_done(job) is called from the worker thread once the job has
+        # finished or failed.
+        self.prune()
+        with self._lock:
+            self.check_accepting()
+            self._jobs[job.id] = job
+            limit = self.platform_limits.get(job.platform, self.workers)
+            if self._running.get(job.platform, 0) < limit:
+                self._running[job.platform] = self._running.get(job.platform, 0) + 1
+                self._start(job, fn, on_done)
+            else:
+                self._pending.setdefault(job.platform, deque()).append((job, fn, on_done))
+                logger.info("Job %s queued behind %s limit of %s", job.id, job.platform, limit)
+        return job
+
+    def check_accepting(self):
+        if self.draining:
+            raise ShuttingDown("Server is shutting down, try again shortly")
+
+    def complete(self, job, file_path, download_name, on_done=None):
+        # Registers a job whose result is already available without running it
+        job.status = 'finished'
+        job.file_path = file_path
+        job.download_name = download_name
+        job.started_at = job.finished_at = time.time()
+        job.settle()
+        with self._lock:
+            self._jobs[job.id] = job
+        if on_done is not None:
+            on_done(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def prune(self):
+        cutoff = time.time() - self.job_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.done and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return expired
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "draining": self.draining,
+                "jobs": len(self._jobs),
+                "running": dict(self._running),
+                "pending": {platform: len(queue) for platform, queue in self._pending.items()},
+            }
+
+    def drain(self, timeout=None):
+        # Stops taking new jobs and waits up to `timeout` seconds for queued
+        # and running ones to finish. Jobs still queued after that are
+        # failed, so their event streams and callbacks finish too. Returns
+        # True if nothing was left behind.
+        with self._lock:
+            self.draining = True
+            logger.info("Draining jobs: %s running, %s queued", sum(self._running.values()),
+                        sum(len(queue) for queue in self._pending.values()))
+            drained = self._idle.wait_for(self._is_idle, timeout=timeout)
+            dropped = []
+            if not drained:
+                logger.warning("Gave up draining after %ss: %s jobs still running", timeout,
+                               sum(self._running.values()))
+                for queue in self._pending.values():
+                    dropped.extend((job, on_done) for job, fn, on_done in queue)
+                self._pending.clear()
+        self._executor.shutdown(wait=drained, cancel_futures=True)
+        with self._lock:
+            # Handed to the executor but never started
+            dropped.extend((job, on_done) for future, job, on_done in self._futures.values() if future.cancelled())
+        for job, on_done in dropped:
+            self._drop(job, on_done)
+        return drained
+
+    def _start(self, job, fn, on_done):
+        # Called with the lock held
+        self._futures[job.id] = (self._executor.submit(self._run, job, fn, on_done), job, on_done)
+
+    def _drop(self, job, on_done):
+        job.error = "Server shut down before the download started"
+        job.status = 'failed'
+        job.finished_at = time.time()
+        job.settle()
+        if on_done is not None:
+            try:
+                on_done(job)
+            except Exception:
+                logger.exception("on_done callback for job %s failed", job.id)
+
+    def _is_idle(self):
+        return not any(self._running.values()) and not any(self._pending.values())
+
+    def _run(self, job, fn, on_done=None):
+        job.status = 'running'
+        job.started_at = time.time()
+        job.report(phase='fetch')
+        job.timings.record('queue', job.started_at - job.created_at)
+        logger.info("Job %s started: URL=%s, Format=%s", job.id, job.url, job.format_type)
+        try:
+            with job.timings.bound():
+                job.file_path, job.download_name = fn(job)
+            job.status = 'finished'
+            logger.info("Job %s finished: %s", job.id, job.file_path)
+        except MediaUnavailable as e:
+            # Answered from the negative cache; the traceback was logged when
+            # the failure was first seen
+            logger.warning("Job %s failed (%s, cached): %s", job.id, e.reason, e)
+            job.error = str(e)
+            job.status = 'failed'
+        except Exception as e:
+            logger.exception("Job %s failed: %s", job.id, e)
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            job.settle()
+            with self._lock:
+                self._futures.pop(job.id, None)
+            self._release(job.platform)
+            if on_done is not None:
+                try:
+                    on_done(job)
+                except Exception:
+                    logger.exception("on_done callback for job %s failed", job.id)
+
+    def _release(self, platform):
+        with self._lock:
+            queue = self._pending.get(platform)
+            if queue:
+                self._start(*queue.popleft())
+            else:
+                self._running[platform] -= 1
+                if self._is_idle():
+                    self._idle.notify_all()
@@ -0,0 +1,256 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds; wide enough for everything from a URL parse to a long transcode
+DEFAULT_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+class _Metric:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, _labels(self.labels, key), value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), then the sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', _labels(self.labels, key, [('le', _number(bound))]), cumulative
+            yield f'{self.name}_sum', _labels(self.labels, key), total
+            yield f'{self.name}_count', _labels(self.labels, key), cumulative
+
+
+class Collected(_Metric):
+    # Read from `fn` at scrape time, for values other modules already keep
+    # (pool sizes, cache hit counts). `fn` returns a number, or a dict from
+    # label value (a tuple when there are several labels) to number.
+
+    def __init__(self, name, help, fn, type='gauge', labels=()):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        self.type = type
+
+    def samples(self):
+        value = self.fn()
+        if not isinstance(value, dict):
+            yield self.name, '', value
+            return
+        for key, number in sorted(value.items()):
+            yield self.name, _labels(self.labels, key if isinstance(key, tuple) else (key,)), number
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collect(self, name, help, fn, type='gauge', labels=()):
+        return self.register(Collected(name, help, fn, type, labels))
+
+    def render(self):
+        # Prometheus text exposition format, version 0.0.4
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception:
+                logger.exception("Collecting metric %s failed", metric.name)
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(f'{name}{labels} {_number(value)}' for name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+requests_total = registry.counter(
+    'downloader_http_requests_total', 'HTTP requests by endpoint and status code', ('endpoint', 'status'))
+request_seconds = registry.histogram(
+    'downloader_http_request_seconds', 'Time from receiving a request to sending its last byte', ('endpoint',))
+phase_seconds = registry.histogram(
+    'downloader_phase_seconds', 'Time spent per phase, per request or job', ('phase', 'platform', 'format'))
+phase_errors = registry.counter(
+    'downloader_phase_errors_total', 'Phases that ended in an exception', ('phase', 'platform', 'format'))
+jobs_total = registry.counter(
+    'downloader_jobs_total', 'Download jobs by outcome (finished, failed or cached)', ('platform', 'format', 'status'))
+
+_current = threading.local()
+
+# Format label values; the format comes from the client, so anything else is
+# folded into 'other' rather than starting a new series
+FORMATS = ('mp4', 'mp3', 'zip', 'none')
+
+
+def format_label(format_type):
+    return format_type if format_type in FORMATS else 'other'
+
+
+class Timings:
+    # Timing spans for one request or download job. Spans of the same phase
+    # add up (a merge downloads two parts); finish() feeds each phase's total
+    # into phase_seconds once, labelled with the request's platform and format.
+    # Phases: parse, extract, queue, download, waiting, merge, remux,
+    # transcode, send.
+
+    def __init__(self, platform='unknown', format='none'):
+        self.labels = {'platform': platform, 'format': format_label(format)}
+        self.spans = {}
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def record(self, phase, seconds):
+        with self._lock:
+            self.spans[phase] = self.spans.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def span(self, phase):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            phase_errors.inc(phase=phase, **self.labels)
+            raise
+        finally:
+            self.record(phase, time.perf_counter() - started)
+
+    def finish(self):
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+            spans = dict(self.spans)
+        for phase, seconds in spans.items():
+            phase_seconds.observe(seconds, phase=phase, **self.labels)
+
+    @contextmanager
+    def bound(self):
+        # Makes these the timings span() records into on this thread
+        previous = activate(self)
+        try:
+            yield self
+        finally:
+            activate(previous)
+
+    def to_dict(self):
+        with self._lock:
+            return {phase: round(seconds, 4) for phase, seconds in self.spans.items()}
+
+    def __str__(self):
+        # Only built when the log line is actually emitted
+        return ' '.join(f'{phase}={seconds:.3f}s' for phase, seconds in self.to_dict().items()) or 'no spans'
+
+
+def activate(timings):
+    # Sets the thread's current timings and returns the previous ones
+    previous = getattr(_current, 'timings', None)
+    _current.timings = timings
+    return previous
+
+
+def current():
+    return getattr(_current, 'timings', None)
+
+
+def label(**labels):
+    # Fills in labels once they are known, e.g. the platform after parsing
+    timings = current()
+    if timings is not None:
+        if 'format' in labels:
+            labels['format'] = format_label(labels['format'])
+        timings.labels.update(labels)
+
+
+@contextmanager
+def span(phase):
+    # Times a phase into the thread's current timings. Work outside any
+    # request or job (batch checks, playlist expansion) gets timings of its
+    # own, observed as soon as the span ends.
+    timings = current()
+    if timings is not None:
+        with timings.span(phase):
+            yield
+        return
+    timings = Timings()
+    try:
+        with timings.span(phase):
+            yield
+    finally:
+        timings.finish()
@@ -0,0 +1,131 @@
+import json
+import logging
+import queue
+import threading
+
+from yt_dlp.utils import PagedList
+
+from downloader import enqueue_download, youtube_limit, youtube_pool
+from jobs import Job
+from urls import platform_of
+from zipstream import ZipStream
+
+logger = logging.getLogger(__name__)
+
+
+def iter_entries(url, limit):
+    # Walks a playlist or channel without materialising it: yt-dlp's tab
+    # extractors return entries as a generator that fetches continuation pages
+    # on demand, so only as many pages as `limit` needs are requested.
+    with youtube_pool.lease('check', noplaylist=False) as ydl:
+        with youtube_limit():
+            result = ydl.extract_info(url, download=False, process=False)
+            if result.get('_type') in ('url', 'url_transparent'):
+                result = ydl.extract_info(result['url'], ie_key=result.get('ie_key'), download=False, process=False)
+
+        count = 0
+        for entry in walk(ydl, result, limit):
+            entry_url = entry.get('webpage_url') or entry.get('url')
+            if not entry_url:
+                continue
+            yield count, entry_url, entry.get('title')
+            count += 1
+            if count >= limit:
+                logger.info("Stopping expansion of %s at %s entries", url, limit)
+                return
+
+
+def walk(ydl, result, limit, depth=0):
+    if result.get('_type') not in ('playlist', 'multi_video'):
+        yield result
+        return
+
+    entries = result.get('entries') or []
+    if isinstance(entries, PagedList):
+        # Only the pages holding the first `limit` entries are fetched
+        entries = entries.getslice(0, limit)
+    for entry in entries:
+        if not entry:
+            continue
+        # A channel URL expands to its tabs (Videos, Shorts, ...); follow them
+        # one level down but no further.
+        if entry.get('_type') == 'playlist' or entry.get('ie_key') == 'YoutubeTab':
+            if depth > 0:
+                continue
+            if entry.get('_type') != 'playlist':
+                entry = ydl.extract_info(entry['url'], ie_key='YoutubeTab', download=False, process=False)
+            yield from walk(ydl, entry, limit, depth + 1)
+        else:
+            yield entry
+
+
+def playlist_jobs(job_manager, url, format_type, limit, on_done=None, before_submit=None):
+    # Yields (index, title, job) for each entry as it is expanded and queued
+    for index, entry_url, title in iter_entries(url, limit):
+        job = Job(entry_url, format_type, platform_of(entry_url))
+        if before_submit is not None:
+            before_submit(index, title, job)
+        enqueue_download(job_manager, job, on_done)
+        yield index, title, job
+
+
+def playlist_zip(job_manager, url, format_type, limit):
+    # Streams a zip of the playlist's files in the order the downloads finish.
+    # Expansion runs on its own thread so entries keep being queued while
+    # earlier ones are written out; it stops queueing once the client has
+    # gone away.
+    done = queue.Queue()
+    entries = {}
+    expansion = {"submitted": 0, "finished": False, "error": None}
+    cancelled = threading.Event()
+
+    def register(index, title, job):
+        # Before the job is queued: a cached entry completes during enqueue
+        entries[job.id] = (index, title)
+
+    def expand():
+        jobs = playlist_jobs(job_manager, url, format_type, limit, done.put, register)
+        try:
+            for _ in jobs:
+                # Counted once queued; an entry whose enqueue raised (disk
+                # full, shutting down) never reaches `done`
+                expansion["submitted"] += 1
+                if cancelled.is_set():
+                    logger.info("Stopping expansion of %s: client went away", url)
+                    break
+        except Exception as e:
+            logger.exception("Error expanding playlist %s: %s", url, e)
+            expansion["error"] = str(e)
+        finally:
+            # Releases the extraction's pool lease straight away
+            jobs.close()
+            expansion["finished"] = True
+            done.put(None)
+
+    threading.Thread(target=expand, name='playlist-expand', daemon=True).start()
+
+    archive = ZipStream()
+    manifest = []
+    received = 0
+    try:
+        while not (expansion["finished"] and received == expansion["submitted"]):
+            job = done.get()
+            if job is None:
+                continue
+            received += 1
+            index, title = entries[job.id]
+            manifest.append({"index": index, "title": title, "url": job.url, "status": job.status,
+                             "error": job.error})
+            if job.status == 'finished':
+                try:
+                    yield from archive.add_file(f"{index + 1:03d} - {job.download_name}", job.file_path)
+                except FileNotFoundError:
+                    manifest[-1].update(status='failed', error="File no longer available")
+
+        manifest.sort(key=lambda item: item["index"])
+        summary = {"url": url, "format": format_type, "entries": manifest, "error": expansion["error"]}
+        yield from archive.add_bytes('manifest.json', json.dumps(summary, indent=2).encode('utf-8'))
+        yield from archive.close()
+    finally:
+        # Also runs when the client goes away mid-download
+        cancelled.set()
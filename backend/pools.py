@@ -0,0 +1,213 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import instaloader
+import yt_dlp
+
+from failures import failure_reason
+
+logger = logging.getLogger(__name__)
+
+# Errors that suggest the context itself is in a bad state (dropped session,
+# expired login, blocked connection) rather than a problem with one URL.
+SESSION_ERRORS = (
+    instaloader.exceptions.ConnectionException,
+    instaloader.exceptions.BadResponseException,
+    instaloader.exceptions.LoginRequiredException,
+)
+
+# Reasons that are about the URL, even when reported as one of the above (a
+# deleted post is a BadResponseException)
+URL_FAILURES = ('not_found', 'unsupported', 'geo_blocked')
+
+
+def is_session_error(error):
+    return isinstance(error, SESSION_ERRORS) and failure_reason(error) not in URL_FAILURES
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class _PooledLoader:
+    def __init__(self, loader, username=None, session_file=None):
+        self.loader = loader
+        self.username = username
+        self.session_file = session_file
+        self.last_checked = time.monotonic()
+        self.failures = 0
+        self.leases = 0
+
+
+class InstaloaderPool:
+    # Long-lived Instaloader instances shared by all Instagram requests, so
+    # cookies and keep-alive connections survive between requests. Each
+    # instance is leased to one thread at a time; pacing of the requests it
+    # makes is up to the caller's rate limiter.
+
+    def __init__(self, size=4, sessions=None, health_check_interval=600, max_failures=3):
+        self.health_check_interval = health_check_interval
+        self.max_failures = max_failures
+        self.replacements = 0
+        self.waits = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+
+        entries = [self._create(username, session_file) for username, session_file in sessions or []]
+        entries = [entry for entry in entries if entry is not None]
+        if not entries:
+            entries = [self._create() for _ in range(size)]
+        self.size = len(entries)
+        for entry in entries:
+            self._queue.put(entry)
+        logged_in = sum(1 for entry in entries if entry.username)
+        logger.info("Instaloader pool ready: %s contexts (%s logged in)", self.size, logged_in)
+
+    @contextmanager
+    def lease(self, timeout=None):
+        try:
+            entry = self._queue.get(block=False)
+        except queue.Empty:
+            with self._lock:
+                self.waits += 1
+            try:
+                entry = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                raise PoolExhausted("No Instagram session available, try again later") from None
+
+        if time.monotonic() - entry.last_checked > self.health_check_interval:
+            entry = self._check(entry)
+
+        entry.leases += 1
+        try:
+            yield entry.loader
+        except Exception as e:
+            if is_session_error(e):
+                entry.failures += 1
+            raise
+        else:
+            entry.failures = 0
+        finally:
+            if entry.failures >= self.max_failures:
+                logger.warning("Replacing Instaloader context after %s consecutive failures", entry.failures)
+                entry = self._replace(entry)
+            self._queue.put(entry)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "available": self._queue.qsize(),
+                "waits": self.waits,
+                "replacements": self.replacements,
+            }
+
+    def _create(self, username=None, session_file=None):
+        # Only used for metadata; media is fetched from the CDN by cdn.download
+        loader = instaloader.Instaloader(quiet=True)
+        if username:
+            try:
+                loader.load_session_from_file(username, session_file)
+                logger.info("Loaded Instagram session for %s", username)
+            except (OSError, instaloader.exceptions.InstaloaderException) as e:
+                logger.error("Failed to load Instagram session for %s: %s", username, e)
+                return None
+        return _PooledLoader(loader, username, session_file)
+
+    def _replace(self, entry):
+        with self._lock:
+            self.replacements += 1
+        try:
+            entry.loader.close()
+        except Exception:
+            pass
+        fresh = self._create(entry.username, entry.session_file)
+        # A session that no longer loads is better served anonymously than not at all
+        return fresh or self._create()
+
+    def _check(self, entry):
+        entry.last_checked = time.monotonic()
+        if not entry.username:
+            return entry
+        try:
+            if entry.loader.test_login() == entry.username:
+                return entry
+        except instaloader.exceptions.InstaloaderException as e:
+            logger.warning("Health check for %s failed: %s", entry.username, e)
+        logger.warning("Instagram session for %s is no longer logged in, reloading", entry.username)
+        return self._replace(entry)
+
+
+class YoutubeDLPool:
+    # Pre-built YoutubeDL instances, one idle set per option profile. Building
+    # a YoutubeDL and loading its extractors costs far more than most
+    # extractions from the metadata cache, so instances are warmed at startup
+    # and leased per request. A lease never blocks: when a profile has no idle
+    # instance a temporary one is built and discarded afterwards. With size=0
+    # every lease builds a fresh instance, which is the unpooled behaviour.
+
+    WARM_EXTRACTORS = ('Youtube', 'YoutubeTab', 'Generic')
+
+    def __init__(self, profiles, size=2):
+        self.profiles = profiles
+        self.size = size
+        self.created = 0
+        self.leases = 0
+        self.overflow = 0
+        self._idle = {name: queue.LifoQueue() for name in profiles}
+        self._lock = threading.Lock()
+
+    def warm(self):
+        started = time.perf_counter()
+        for name in self.profiles:
+            while self._idle[name].qsize() < self.size:
+                self._idle[name].put(self._create(name))
+        logger.info("Warmed %s YoutubeDL instances per profile (%s) in %.2fs", self.size,
+                    ', '.join(self.profiles), time.perf_counter() - started)
+
+    @contextmanager
+    def lease(self, profile, **overrides):
+        # Overrides apply to this lease only; the instance's own params are put
+        # back before it returns to the pool. Options compiled at construction
+        # (format, postprocessors, progress hooks) can't be overridden here.
+        try:
+            ydl = self._idle[profile].get(block=False)
+        except queue.Empty:
+            ydl = self._create(profile)
+            with self._lock:
+                self.overflow += 1
+        with self._lock:
+            self.leases += 1
+
+        params = ydl.params
+        if overrides:
+            ydl.params = dict(params, **overrides)
+        try:
+            yield ydl
+        finally:
+            ydl.params = params
+            if self._idle[profile].qsize() < self.size:
+                self._idle[profile].put(ydl)
+            else:
+                ydl.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "idle": {name: idle.qsize() for name, idle in self._idle.items()},
+                "created": self.created,
+                "leases": self.leases,
+                "overflow": self.overflow,
+            }
+
+    def _create(self, profile):
+        ydl = yt_dlp.YoutubeDL(dict(self.profiles[profile]))
+        for ie_key in self.WARM_EXTRACTORS:
+            ydl.get_info_extractor(ie_key)
+        with self._lock:
+            self.created += 1
+        return ydl
@@ -0,0 +1,74 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Codecs that can go into an mp4 as-is and still play everywhere. Anything else
+# has to be transcoded.
+MP4_VIDEO_CODECS = ('avc1', 'avc3', 'h264')
+MP4_AUDIO_CODECS = ('mp4a', 'aac', 'mp3')
+
+
+def _codec_in(codec, families):
+    return bool(codec) and codec != 'none' and codec.lower().startswith(families)
+
+
+def selected_formats(info):
+    # The formats yt-dlp picked: one entry for a single file, or the video and
+    # audio parts of a merge.
+    return info.get('requested_formats') or [info]
+
+
+def plan_mp4(info):
+    formats = selected_formats(info)
+    video = next((f for f in formats if f.get('vcodec') not in (None, 'none')), None)
+    audio = next((f for f in formats if f.get('acodec') not in (None, 'none')), None)
+    copyable = (
+        (video is None or _codec_in(video.get('vcodec'), MP4_VIDEO_CODECS))
+        and (audio is None or _codec_in(audio.get('acodec'), MP4_AUDIO_CODECS))
+    )
+
+    if len(formats) > 1:
+        if copyable:
+            # The merger stream-copies both parts into the mp4
+            return 'merge', {'merge_output_format': 'mp4'}
+        return 'transcode', {
+            'merge_output_format': 'mkv',
+            'postprocessors': [{'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}],
+        }
+
+    if info.get('ext') == 'mp4' and copyable:
+        return 'none', {}
+    if copyable:
+        return 'remux', {
+            'postprocessors': [{'key': 'FFmpegVideoRemuxer', 'preferedformat': 'mp4'}],
+        }
+    return 'transcode', {
+        'postprocessors': [{'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}],
+    }
+
+
+def plan_mp3(info):
+    # FFmpegExtractAudio copies the stream when it's already mp3
+    audio = selected_formats(info)[-1]
+    plan = 'copy' if _codec_in(audio.get('acodec'), ('mp3',)) else 'transcode'
+    return plan, {
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': '192',
+        }],
+    }
+
+
+def plan_postprocessing(info, format_type):
+    # Returns (plan, yt-dlp options) for the formats already selected in
+    # `info`, so ffmpeg only re-encodes when the codecs leave no choice.
+    if format_type == 'mp4':
+        plan, options = plan_mp4(info)
+    else:
+        plan, options = plan_mp3(info)
+    logger.info("Postprocessing plan for %s: %s", info.get('id'), plan)
+    if logger.isEnabledFor(logging.DEBUG):
+        codecs = [(f.get('format_id'), f.get('vcodec'), f.get('acodec')) for f in selected_formats(info)]
+        logger.debug("Selected formats for %s: %s", info.get('id'), codecs)
+    return plan, options
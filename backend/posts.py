@@ -0,0 +1,119 @@
+import logging
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from cdn import CHUNK_SIZE, iter_content
+from zipstream import ZipStream
+
+logger = logging.getLogger(__name__)
+
+# Sentinel a fetch puts on its queue once the item is complete
+_DONE = object()
+
+POST_TYPES = {
+    'GraphImage': 'image',
+    'GraphVideo': 'video',
+    'GraphSidecar': 'carousel',
+}
+
+
+def post_items(post):
+    # (file name, CDN url) for each item of a post, in carousel order. The
+    # sidecar nodes come from the post's own metadata, so listing them costs
+    # no further Instagram requests.
+    base = f"{post.owner_username}_{post.shortcode}"
+    if post.typename == 'GraphSidecar':
+        return [
+            (f"{base}_{index:02d}.mp4", node.video_url) if node.is_video
+            else (f"{base}_{index:02d}.jpg", node.display_url)
+            for index, node in enumerate(post.get_sidecar_nodes(), 1)
+        ]
+    if post.is_video:
+        return [(f"{base}.mp4", post.video_url)]
+    return [(f"{base}.jpg", post.url)]
+
+
+class _Item:
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        # Chunks fetched ahead of the zip writer; a full queue pauses the fetch
+        self.chunks = queue.Queue(max(1, config.INSTAGRAM_ITEM_BUFFER // CHUNK_SIZE))
+
+
+def _offer(item, value, cancelled):
+    while not cancelled.is_set():
+        try:
+            item.chunks.put(value, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _fetch(item, cancelled):
+    try:
+        for chunk in iter_content(item.url):
+            if not _offer(item, chunk, cancelled):
+                return
+        result = _DONE
+    except Exception as e:
+        logger.warning("Fetching %s failed: %s", item.name, e)
+        result = e
+    _offer(item, result, cancelled)
+
+
+def _drain(item):
+    while True:
+        chunk = item.chunks.get()
+        if chunk is _DONE:
+            return
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+
+def post_zip(post):
+    return zip_items(post_items(post))
+
+
+def zip_items(files, trailer=None):
+    # Streams a zip of (file name, CDN url) pairs, which may come from a
+    # generator. Items are fetched concurrently and written in order: while
+    # the writer copies one item out, the next few are already downloading
+    # into their buffers. `trailer()` may return (name, bytes) members to
+    # add once every item has been written.
+    files = iter(files)
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=config.INSTAGRAM_ITEM_CONCURRENCY, thread_name_prefix='post-item')
+    window = deque()
+
+    def fill():
+        while len(window) < 2 * config.INSTAGRAM_ITEM_CONCURRENCY:
+            entry = next(files, None)
+            if entry is None:
+                return
+            item = _Item(*entry)
+            executor.submit(_fetch, item, cancelled)
+            window.append(item)
+
+    archive = ZipStream()
+    try:
+        fill()
+        while window:
+            item = window.popleft()
+            yield from archive.add_stream(item.name, _drain(item))
+            fill()
+        for name, data in trailer() if trailer is not None else ():
+            yield from archive.add_bytes(name, data)
+        yield from archive.close()
+    finally:
+        # Also runs when the client goes away mid-download
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        if hasattr(files, 'close'):
+            # Lets a generator of files release what it holds (a pool lease)
+            files.close()
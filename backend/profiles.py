@@ -0,0 +1,212 @@
+import calendar
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+
+import instaloader
+
+import config
+import metrics
+from downloader import instagram_limit, instagram_pool
+from posts import post_items, zip_items
+
+logger = logging.getLogger(__name__)
+
+# Posts per page of Profile.get_posts(); each page is one upstream request
+FEED_PAGE_SIZE = 12
+
+
+class HighWaterMarks:
+    # The newest post archived per profile, one small JSON file each, so an
+    # archive can pick up where the last one stopped across restarts. Files
+    # are replaced atomically, as the media store does with its sidecars.
+    # An archive cut short at its post limit leaves the mark where it was and
+    # records a backfill instead: the newest post it archived, its `since`,
+    # and the timestamp its older posts continue `before`.
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, username):
+        return os.path.join(self.root, f"{username.lower()}.json")
+
+    def get(self, username):
+        # Returns {"shortcode": ..., "timestamp": ..., "backfill": ...} or None
+        try:
+            with open(self._path(username)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning("Ignoring unreadable high-water mark for %s", username)
+            return None
+
+    def advance(self, username, newest=None, backfill=None):
+        # Moves the mark to `newest` and stores `backfill` (None when there
+        # is nothing left to backfill). The mark only ever moves forward;
+        # concurrent archives of one profile can't wind it back.
+        with self._lock:
+            mark = merge_mark(self.get(username), newest, backfill)
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp-', suffix='.json')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(mark, f)
+            os.replace(tmp_path, self._path(username))
+            return mark
+
+
+def merge_mark(current, newest=None, backfill=None):
+    mark = {"shortcode": None, "timestamp": None}
+    if current is not None:
+        mark.update(shortcode=current["shortcode"], timestamp=current["timestamp"])
+    if newest is not None and (mark["timestamp"] is None or newest["timestamp"] > mark["timestamp"]):
+        mark.update(shortcode=newest["shortcode"], timestamp=newest["timestamp"])
+    if backfill is not None:
+        mark["backfill"] = backfill
+    return mark
+
+
+archive_marks = HighWaterMarks(config.ARCHIVE_STATE_DIR)
+
+
+def post_timestamp(post):
+    return calendar.timegm(post.date_utc.utctimetuple())
+
+
+def feed(L, profile):
+    # Profile.get_posts() is a generator that requests the next page only
+    # when the previous one runs out, so each page takes a rate limit token.
+    # Archives wait for tokens rather than failing half way through a stream.
+    with metrics.span('extract'), instagram_limit(L, timeout=None):
+        posts = profile.get_posts()
+    count = 0
+    while True:
+        if count and count % FEED_PAGE_SIZE == 0:
+            with metrics.span('extract'), instagram_limit(L, timeout=None):
+                post = next(posts, None)
+        else:
+            post = next(posts, None)
+        if post is None:
+            return
+        yield post
+        count += 1
+
+
+def new_posts(L, profile, since, before, limit):
+    # Posts newer than `since` (a timestamp, or None for all) and older than
+    # `before` (None for the newest), newest first. The feed is in date order
+    # apart from pinned posts at its head, so the first older post that isn't
+    # pinned ends the walk. Pinned posts went into the archive that started
+    # from the head of the feed, so a backfill skips them.
+    count = 0
+    for post in feed(L, profile):
+        pinned = getattr(post, 'is_pinned', False)
+        if before is not None and (pinned or post_timestamp(post) >= before):
+            continue
+        if since is not None and post_timestamp(post) <= since:
+            if pinned:
+                continue
+            return
+        yield post
+        count += 1
+        if count >= limit:
+            logger.info("Stopping archive of %s at %s posts", profile.username, limit)
+            return
+
+
+def profile_zip(profile, since=None, before=None, limit=config.PROFILE_ARCHIVE_MAX_POSTS, marks=archive_marks):
+    # Streams a zip of a profile's posts newer than `since` (and older than
+    # `before` when continuing a backfill), items fetched in parallel from
+    # the CDN as for a single post. The high-water mark moves once the whole
+    # zip has been handed to the server, so a stream cut short leaves it
+    # where it was; an archive that stops at `limit` records where the next
+    # one continues instead.
+    manifest = []
+    walk = {"oldest": None, "error": None}
+    items = queue.Queue()
+    cancelled = threading.Event()
+
+    def expand():
+        # Runs on its own thread, ahead of the writer, so the Instaloader
+        # context is leased for as long as the feed pages and post metadata
+        # take to fetch rather than for as long as the client takes to read
+        # the zip. Items are (name, CDN url) pairs, small enough to queue.
+        try:
+            with instagram_pool.lease(timeout=config.INSTAGRAM_LEASE_TIMEOUT) as L:
+                # The profile was resolved on another context; rebind its node
+                owner = instaloader.Profile(L.context, profile._node)
+                if since is None and before is None and owner.profile_pic_url:
+                    items.put((f"{owner.username}_profile_pic.jpg", owner.profile_pic_url))
+                for post in new_posts(L, owner, since, before, limit):
+                    if cancelled.is_set():
+                        return
+                    if post.typename == 'GraphImage':
+                        post_files = post_items(post)
+                    else:
+                        # Sidecar nodes and video URLs may need the full metadata
+                        with metrics.span('extract'), instagram_limit(L, timeout=None):
+                            post_files = post_items(post)
+                    manifest.append({"shortcode": post.shortcode, "timestamp": post_timestamp(post),
+                                     "type": post.typename, "items": len(post_files)})
+                    if not getattr(post, 'is_pinned', False):
+                        walk["oldest"] = post_timestamp(post)
+                    for item in post_files:
+                        items.put(item)
+        except Exception as e:
+            walk["error"] = e
+        finally:
+            items.put(None)
+
+    def files():
+        threading.Thread(target=expand, name='profile-expand', daemon=True).start()
+        try:
+            while True:
+                item = items.get()
+                if item is None:
+                    break
+                yield item
+        finally:
+            # Also runs when the client goes away mid-download
+            cancelled.set()
+        if walk["error"] is not None:
+            raise walk["error"]
+
+    def mark_update():
+        # (newest, backfill) for HighWaterMarks.advance, or None to leave
+        # the mark as it is
+        current = marks.get(profile.username) or {}
+        pending = current.get("backfill") if before is not None else None
+        newest = None
+        if manifest:
+            post = max(manifest, key=lambda post: post["timestamp"])
+            newest = {"shortcode": post["shortcode"], "timestamp": post["timestamp"]}
+        if len(manifest) >= limit and walk["oldest"] is not None:
+            # Older posts are left for the next archive. The backfill keeps
+            # the newest post and the `since` of the archive it started from.
+            start = pending or dict(newest, since=since)
+            return None, dict(start, before=walk["oldest"])
+        if before is not None:
+            # Backfill complete: everything up to its newest post is archived
+            return pending, None
+        if newest is None:
+            return None
+        return newest, current.get("backfill")
+
+    def trailer():
+        update = mark_update()
+        mark = merge_mark(marks.get(profile.username), *update) if update else marks.get(profile.username)
+        logger.info("Archived %s posts of %s", len(manifest), profile.username)
+        summary = {"username": profile.username, "since": since, "before": before, "posts": manifest,
+                   "mark": mark, "truncated": len(manifest) >= limit}
+        return [('manifest.json', json.dumps(summary, indent=2).encode('utf-8'))]
+
+    yield from zip_items(files(), trailer)
+    # Only reached once the server asks for more after the last chunk, so
+    # the whole zip, manifest and central directory included, has been sent
+    update = mark_update()
+    if update:
+        marks.advance(profile.username, *update)
@@ -0,0 +1,164 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upstream errors that mean "slow down" rather than "this URL is broken":
+# Instaloader's TooManyRequests/Forbidden exceptions, yt-dlp's "HTTP Error
+# 429: Too Many Requests" / "HTTP Error 403: Forbidden", and HTTP errors
+# carrying a 403/429 response. Markers are whole phrases; bare status codes would also match
+# video ids and titles that happen to contain the digits.
+THROTTLE_CLASSES = ('TooManyRequestsException', 'QueryReturnedForbiddenException')
+THROTTLE_MARKERS = ('HTTP Error 429', 'HTTP Error 403', 'Too Many Requests', 'Please wait a few minutes')
+THROTTLE_STATUSES = (403, 429)
+
+
+class RateLimited(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_throttled(error):
+    if isinstance(error, RateLimited) or getattr(error, 'reason', None) == 'throttled':
+        return True
+    if type(error).__name__ in THROTTLE_CLASSES:
+        return True
+    if getattr(getattr(error, 'response', None), 'status_code', None) in THROTTLE_STATUSES:
+        return True
+    text = str(error)
+    return any(marker in text for marker in THROTTLE_MARKERS)
+
+
+class TokenBucket:
+    # Refills at `rate` tokens per second up to `burst`. After a throttling
+    # response the bucket is blocked for an exponentially growing, jittered
+    # delay; the delay resets once a request gets through again.
+
+    def __init__(self, rate, burst=1, base_backoff=30.0, max_backoff=900.0):
+        self.rate = rate
+        self.burst = burst
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.level = 0
+        self.acquired = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.backoffs = 0
+
+    def delay(self, now):
+        # Seconds until a token is available; call with the limiter's lock held
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def backoff(self, now):
+        self.level += 1
+        self.backoffs += 1
+        delay = min(self.max_backoff, self.base_backoff * 2 ** (self.level - 1))
+        delay = random.uniform(delay / 2, delay)
+        self.blocked_until = max(self.blocked_until, now + delay)
+        self.tokens = 0.0
+        return delay
+
+    def stats(self, now):
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "tokens": round(min(self.burst, self.tokens + (now - self.updated) * self.rate), 3),
+            "blocked_for": round(max(0.0, self.blocked_until - now), 3),
+            "backoff_level": self.level,
+            "backoffs": self.backoffs,
+            "acquired": self.acquired,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
+
+
+class RateLimiter:
+    # Named token buckets. A request names every bucket it counts against
+    # (e.g. the platform and the session making it) and waits until all of
+    # them have a token.
+
+    def __init__(self, base_backoff=30.0, max_backoff=900.0):
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def configure(self, name, rate, burst=1):
+        with self._lock:
+            self._buckets[name] = TokenBucket(rate, burst, self.base_backoff, self.max_backoff)
+
+    def acquire(self, names, timeout=None):
+        # Returns the seconds spent waiting. Raises RateLimited if the wait
+        # would run past `timeout`.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                buckets = [self._buckets[name] for name in names if name in self._buckets]
+                delay = max((bucket.delay(now) for bucket in buckets), default=0.0)
+                if delay <= 0:
+                    for bucket in buckets:
+                        bucket.tokens -= 1
+                        bucket.acquired += 1
+                        if waited:
+                            bucket.waits += 1
+                            bucket.wait_seconds += waited
+                    return waited
+            if deadline is not None and now + delay > deadline:
+                raise RateLimited(f"Rate limited by {', '.join(names)}, try again later", retry_after=delay)
+            time.sleep(delay)
+            waited += delay
+
+    def backoff(self, names):
+        with self._lock:
+            now = time.monotonic()
+            delays = [self._buckets[name].backoff(now) for name in names if name in self._buckets]
+        if delays:
+            logger.warning("Throttled upstream, backing off %s for %.1fs", ', '.join(names), max(delays))
+
+    def succeed(self, names):
+        with self._lock:
+            for name in names:
+                if name in self._buckets:
+                    self._buckets[name].level = 0
+
+    def blocked_for(self, names):
+        with self._lock:
+            now = time.monotonic()
+            return max((self._buckets[name].blocked_until - now for name in names if name in self._buckets),
+                       default=0.0)
+
+    @contextmanager
+    def guard(self, names, timeout=None):
+        # Acquires a token, then backs the buckets off if the guarded call
+        # fails with a throttling error.
+        self.acquire(names, timeout)
+        try:
+            yield
+        except Exception as e:
+            # Local rejections (this limiter, the negative cache) already
+            # reflect an earlier backoff; only fresh upstream answers count
+            if is_throttled(e) and not isinstance(e, RateLimited) and getattr(e, 'reason', None) is None:
+                self.backoff(names)
+            raise
+        else:
+            self.succeed(names)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {name: bucket.stats(now) for name, bucket in self._buckets.items()}
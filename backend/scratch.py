@@ -0,0 +1,105 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class ScratchFull(Exception):
+    pass
+
+
+class ScratchSpace:
+    # Every fetch gets its own working directory under `root`, so jobs never
+    # share output paths and nothing has to scan the directory to find its
+    # files. Directories are removed when the fetch ends; the sweeper reclaims
+    # any left behind by a crash or a killed worker. New work is refused while
+    # the filesystem has less than min_free_bytes available.
+
+    def __init__(self, root, max_age=6 * 3600, min_free_bytes=0):
+        self.root = root
+        self.max_age = max_age
+        self.min_free_bytes = min_free_bytes
+        self.swept = 0
+        self.refused = 0
+        self._active = set()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.root).free
+
+    def check_room(self):
+        free = self.free_bytes()
+        if free < self.min_free_bytes:
+            with self._lock:
+                self.refused += 1
+            logger.warning("Refusing work: %s bytes free in %s, need %s", free, self.root, self.min_free_bytes)
+            raise ScratchFull("Server is low on disk space, try again later")
+
+    @contextmanager
+    def directory(self, label):
+        self.check_room()
+        path = tempfile.mkdtemp(dir=self.root, prefix=f'{label}-')
+        with self._lock:
+            self._active.add(path)
+        try:
+            yield path
+        finally:
+            with self._lock:
+                self._active.discard(path)
+            shutil.rmtree(path, ignore_errors=True)
+
+    def sweep(self):
+        cutoff = time.time() - self.max_age
+        removed = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            with self._lock:
+                if path in self._active:
+                    continue
+            try:
+                if os.path.getmtime(path) > cutoff:
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning("Could not remove abandoned scratch path %s: %s", path, e)
+                continue
+            removed += 1
+        if removed:
+            logger.info("Swept %s abandoned scratch paths from %s", removed, self.root)
+        with self._lock:
+            self.swept += removed
+        return removed
+
+    def start_sweeper(self, interval):
+        def run():
+            while True:
+                try:
+                    self.sweep()
+                except Exception:
+                    logger.exception("Scratch sweep failed")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name='scratch-sweeper', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": len(self._active),
+                "swept": self.swept,
+                "refused": self.refused,
+                "free_bytes": self.free_bytes(),
+                "min_free_bytes": self.min_free_bytes,
+            }
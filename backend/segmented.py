@@ -0,0 +1,55 @@
+import time
+
+from yt_dlp.downloader import external
+from yt_dlp.downloader.external import ExternalFD
+
+import cdn
+import config
+
+# Name to pass as yt-dlp's `external_downloader`, e.g. {'http': SEGMENTED}
+SEGMENTED = 'segmented'
+
+
+class SegmentedFD(ExternalFD):
+    # yt-dlp downloader for single-file http(s) formats that runs
+    # cdn.download instead of an external program: parallel Range requests
+    # into a file allocated up front, rather than yt-dlp's one connection,
+    # which CDNs throttle per connection. Fragmented (DASH/HLS) formats keep
+    # yt-dlp's own downloaders.
+    SUPPORTED_PROTOCOLS = ('http', 'https')
+
+    @classmethod
+    def available(cls, path=None):
+        # Nothing to find on PATH
+        return True
+
+    @classmethod
+    def supports(cls, info_dict):
+        return 'fragments' not in info_dict and super().supports(info_dict)
+
+    def _call_downloader(self, tmpfilename, info_dict):
+        filename = self.undo_temp_name(tmpfilename)
+        started = time.time()
+
+        def progress(downloaded, total):
+            elapsed = time.time() - started
+            speed = downloaded / elapsed if elapsed else None
+            self._hook_progress({
+                'status': 'downloading',
+                'filename': filename,
+                'tmpfilename': tmpfilename,
+                'downloaded_bytes': downloaded,
+                'total_bytes': total,
+                'elapsed': elapsed,
+                'speed': speed,
+                'eta': (total - downloaded) / speed if total and speed else None,
+            }, info_dict)
+
+        cdn.download(info_dict['url'], tmpfilename, connections=config.CDN_CONNECTIONS,
+                     segment_size=config.CDN_SEGMENT_SIZE, retries=config.CDN_SEGMENT_RETRIES,
+                     headers=info_dict.get('http_headers'), progress=progress)
+        return 0
+
+
+# yt-dlp looks external downloaders up by name in this table
+external._BY_NAME[SEGMENTED] = SegmentedFD
@@ -0,0 +1,65 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    # Collapses concurrent calls that share a key into one execution. The
+    # first caller runs the function; everyone who arrives while it is in
+    # flight blocks and receives the same return value or exception.
+
+    def __init__(self, name):
+        self.name = name
+        self.executions = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            logger.info("Waiting on in-flight %s for %s", self.name, key)
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+            if call.waiters:
+                logger.info("Shared %s result for %s with %s waiters", self.name, key, call.waiters)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+            }
@@ -0,0 +1,259 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class StoredMedia:
+    def __init__(self, key, path, size, download_name, meta=None, accessed=None):
+        self.key = key
+        self.path = path
+        self.size = size
+        self.download_name = download_name
+        self.meta = meta or {}
+        self.accessed = accessed or time.time()
+
+
+class PinnedFile:
+    # File object handed out by MediaStore.open. The store won't delete the
+    # file while it is open; closing it releases the pin, and if the entry
+    # was evicted in the meantime the file is removed then.
+
+    def __init__(self, store, path):
+        self._release = store.pin(path)
+        try:
+            self._file = open(path, 'rb')
+        except OSError:
+            self._release()
+            raise
+        self.path = path
+        self.closed = False
+        self._on_close = []
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def call_on_close(self, func):
+        # Runs `func` once the file has been closed and its pin released
+        self._on_close.append(func)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._file.close()
+        finally:
+            self._release()
+        for func in self._on_close:
+            func()
+
+
+class MediaStore:
+    # Finished media keyed by (canonical media id, format, quality). Files are
+    # named by the sha256 of the key, published with a temp file + rename so
+    # readers never see a partial file, and evicted least-recently-used first
+    # once the store grows past max_bytes. Files that are being sent are
+    # pinned; evicting one only drops it from the index, and the file itself
+    # goes when the last reader closes it. Entries used within the last
+    # grace_period seconds are kept even past max_bytes, so a client can come
+    # back to resume a download it just started.
+
+    def __init__(self, root, max_bytes, grace_period=0):
+        # Absolute, so the paths handed out don't depend on the cwd of
+        # whoever resolves them (send_file resolves against the app root)
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.grace_period = grace_period
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._index = OrderedDict()
+        self._readers = {}
+        self._doomed = set()
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def digest(key):
+        return hashlib.sha256('\0'.join(key).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def path_digest(path):
+        # Inverse of the naming in publish: <digest><ext>
+        return os.path.splitext(os.path.basename(path))[0]
+
+    def get(self, key):
+        return self.lookup(self.digest(key))
+
+    def lookup(self, digest):
+        with self._lock:
+            entry = self._index.get(digest)
+            if entry is None or not os.path.exists(entry.path):
+                if entry is not None:
+                    self._forget(digest)
+                self.misses += 1
+                return None
+            self._index.move_to_end(digest)
+            entry.accessed = time.time()
+            self.hits += 1
+        # Access time orders the index when it's rebuilt after a restart.
+        try:
+            os.utime(entry.path, (time.time(), os.path.getmtime(entry.path)))
+        except OSError:
+            pass
+        return entry
+
+    def pin(self, path):
+        # Keeps `path` on disk until the returned release function is called.
+        # Raises FileNotFoundError if the file is already gone.
+        with self._lock:
+            if not os.path.exists(path):
+                raise FileNotFoundError(path)
+            self._readers[path] = self._readers.get(path, 0) + 1
+        return lambda: self._unpin(path)
+
+    def open(self, path):
+        # Opens `path` for reading, pinned until the file is closed. Raises
+        # FileNotFoundError if it is already gone.
+        return PinnedFile(self, path)
+
+    def _unpin(self, path):
+        with self._lock:
+            self._readers[path] -= 1
+            if self._readers[path]:
+                return
+            del self._readers[path]
+            if path not in self._doomed:
+                return
+            self._doomed.discard(path)
+        logger.info("Removing evicted media file %s after its last reader closed", path)
+        self._remove(path)
+
+    def publish(self, key, src_path, download_name, meta=None):
+        # Moves src_path into the store. The final name only ever points at a
+        # complete file; concurrent publishes of the same key just replace it.
+        digest = self.digest(key)
+        ext = os.path.splitext(src_path)[1]
+        path = os.path.join(self.root, digest + ext)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp-', suffix=ext)
+        os.close(fd)
+        try:
+            shutil.move(src_path, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        entry = StoredMedia(list(key), path, os.path.getsize(path), download_name, meta)
+        self._write_sidecar(digest, entry)
+
+        with self._lock:
+            self._forget(digest)
+            # Republished under the same name: it is live again
+            self._doomed.discard(path)
+            self._index[digest] = entry
+            self.total_bytes += entry.size
+            self._evict()
+        logger.info("Published %s to media store as %s (%s bytes)", key, path, entry.size)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "open_readers": sum(self._readers.values()),
+                "pending_removal": len(self._doomed),
+            }
+
+    def _write_sidecar(self, digest, entry):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp-', suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                "key": entry.key,
+                "file": os.path.basename(entry.path),
+                "download_name": entry.download_name,
+                "meta": entry.meta,
+            }, f)
+        os.replace(tmp_path, os.path.join(self.root, digest + '.json'))
+
+    def _forget(self, digest):
+        entry = self._index.pop(digest, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    def _evict(self):
+        cutoff = time.time() - self.grace_period
+        while self.total_bytes > self.max_bytes and len(self._index) > 1:
+            digest, entry = next(iter(self._index.items()))
+            if entry.accessed > cutoff:
+                # The index is in access order, so everything after is newer
+                logger.warning("Media store over budget (%s bytes) with only entries in their grace period left",
+                               self.total_bytes)
+                break
+            del self._index[digest]
+            self.total_bytes -= entry.size
+            logger.info("Evicting %s from media store (%s bytes)", entry.key, entry.size)
+            self._remove(os.path.join(self.root, digest + '.json'))
+            if entry.path in self._readers:
+                self._doomed.add(entry.path)
+            else:
+                self._remove(entry.path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _load(self):
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith('.tmp-'):
+                os.remove(path)
+                continue
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(path) as f:
+                    meta = json.load(f)
+                media_path = os.path.join(self.root, meta['file'])
+                st = os.stat(media_path)
+            except (OSError, ValueError, KeyError):
+                logger.warning("Dropping unreadable media store entry %s", name)
+                os.remove(path)
+                continue
+            entry = StoredMedia(meta['key'], media_path, st.st_size, meta['download_name'], meta.get('meta'),
+                                accessed=st.st_atime)
+            entries.append((st.st_atime, name[:-len('.json')], entry))
+
+        for _, digest, entry in sorted(entries, key=lambda item: item[0]):
+            self._index[digest] = entry
+            self.total_bytes += entry.size
+        self._evict()
+        logger.info("Media store loaded %s entries (%s bytes)", len(self._index), self.total_bytes)
@@ -0,0 +1,126 @@
+import logging
+import threading
+
+import instaloader
+
+import metrics
+from cache import TTLCache
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# The reels_media query Instaloader's Highlight uses for a highlight's items.
+# Highlight URLs carry only the highlight id; the response names the owner.
+HIGHLIGHT_ITEMS_QUERY = '45246d3fe16ccc6577e0bd297a5db1ab'
+
+
+class StoryNotFound(Exception):
+    pass
+
+
+class ProfileIndex:
+    # What one profile's stories and highlights resolve to: the Profile, its
+    # current stories by mediaid, and the items of each highlight looked up so
+    # far by highlight id. Each part is filled the first time it is needed.
+
+    def __init__(self, username):
+        self.username = username
+        self.profile = None
+        self.stories = None
+        self.highlights = {}
+
+
+class StoryIndex:
+    # Per-profile indexes, kept for `ttl` seconds. Resolving a story costs at
+    # most two upstream requests (the profile, then its story reel, which
+    # holds every item) and a highlight one; repeats within the TTL cost none.
+    # Profile checks and archives reuse the resolved Profile the same way.
+    # `limit(L)` is the rate limit guard wrapped around each request.
+
+    def __init__(self, limit, ttl=300, maxsize=256):
+        self.limit = limit
+        self._profiles = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._highlight_owners = TTLCache(maxsize=maxsize * 8, ttl=ttl)
+        self._flights = SingleFlight('story index')
+        self._lock = threading.Lock()
+
+    def story(self, L, username, mediaid):
+        index = self._index(username)
+        item = index.stories.get(mediaid) if index.stories is not None else None
+        if item is None:
+            # Not listed yet, or posted since the listing was taken
+            self._flights.do(f"stories:{username}", self._list_stories, L, index)
+            item = index.stories.get(mediaid)
+        if item is None:
+            raise StoryNotFound(f"Story {mediaid} not found for {username}; it may have expired")
+        return item
+
+    def profile(self, L, username):
+        index = self._index(username)
+        if index.profile is None:
+            self._flights.do(f"profile:{username}", self._resolve_profile, L, index)
+        return index.profile
+
+    def highlight(self, L, highlight_id):
+        # Returns (owner username, title, items)
+        owner = self._highlight_owners.get(highlight_id)
+        if owner is not None:
+            found = self._index(owner).highlights.get(highlight_id)
+            if found is not None:
+                return (owner,) + found
+        return self._flights.do(f"highlight:{highlight_id}", self._fetch_highlight, L, highlight_id)
+
+    def stats(self):
+        return dict(self._profiles.stats(), flights=self._flights.stats())
+
+    def _index(self, username):
+        with self._lock:
+            index = self._profiles.get(username)
+            if index is None:
+                index = ProfileIndex(username)
+                self._profiles.set(username, index)
+            return index
+
+    def _resolve_profile(self, L, index):
+        with metrics.span('extract'), self.limit(L):
+            index.profile = instaloader.Profile.from_username(L.context, index.username)
+
+    def _list_stories(self, L, index):
+        if index.profile is None:
+            self._resolve_profile(L, index)
+        with metrics.span('extract'), self.limit(L):
+            reels = list(L.get_stories(userids=[index.profile.userid]))
+        index.stories = {item.mediaid: item for reel in reels for item in reel.get_items()}
+        logger.info("Indexed %s stories of %s", len(index.stories), index.username)
+
+    def _fetch_highlight(self, L, highlight_id):
+        with metrics.span('extract'), self.limit(L):
+            data = L.context.graphql_query(HIGHLIGHT_ITEMS_QUERY, {
+                "reel_ids": [], "tag_names": [], "location_ids": [],
+                "highlight_reel_ids": [str(highlight_id)], "precomposed_overlay": False,
+            })
+        reels = data['data']['reels_media']
+        if not reels:
+            raise StoryNotFound(f"Highlight {highlight_id} not found")
+        reel = reels[0]
+        owner = instaloader.Profile(L.context, reel['owner'])
+        items = [instaloader.StoryItem(L.context, node, owner) for node in reel['items']]
+        if not items:
+            raise StoryNotFound(f"Highlight {highlight_id} is empty")
+
+        index = self._index(owner.username)
+        index.highlights[highlight_id] = (reel.get('title'), items)
+        self._highlight_owners.set(highlight_id, owner.username)
+        return owner.username, reel.get('title'), items
+
+
+def story_files(username, label, items):
+    # (file name, CDN url) for story items, as posts.post_items does for posts
+    files = []
+    for index, item in enumerate(items, 1):
+        suffix = f"_{index:02d}" if len(items) > 1 else ''
+        if item.is_video:
+            files.append((f"{username}_{label}{suffix}.mp4", item.video_url))
+        else:
+            files.append((f"{username}_{label}{suffix}.jpg", item.url))
+    return files
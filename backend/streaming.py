@@ -0,0 +1,70 @@
+import logging
+import time
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+POLL_INTERVAL = 0.25
+
+
+def content_disposition(filename):
+    # Same shape Flask's send_file uses: an ASCII fallback plus the RFC 5987
+    # UTF-8 form for titles with non-ASCII characters.
+    fallback = filename.encode('ascii', 'ignore').decode('ascii').replace('"', '').replace('\\', '')
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def open_source(job, partial_path, timeout):
+    # Blocks until there is something to stream: the partial file a running
+    # download is writing to, or the finished file. Returns it opened, or None
+    # if the job failed or nothing showed up within `timeout` seconds.
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        path = partial_path(job)
+        if not path and job.done:
+            if job.status != 'finished':
+                return None
+            path = job.file_path
+        if path:
+            try:
+                return open(path, 'rb')
+            except FileNotFoundError:
+                # Renamed between lookup and open; look again
+                pass
+        time.sleep(POLL_INTERVAL)
+    return None
+
+
+def follow(job, f):
+    # Yields the file's bytes as they are written. yt-dlp renames the .part
+    # file and the store moves it once the download completes, but the open
+    # descriptor keeps pointing at the same data, so reading to EOF after the
+    # job is done yields the complete file.
+    with f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if chunk:
+                yield chunk
+                continue
+            if job.done:
+                if job.status == 'failed':
+                    logger.error("Job %s failed mid-stream: %s", job.id, job.error)
+                    raise IOError(job.error)
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+            time.sleep(POLL_INTERVAL)
+
+
+def read_range(f, start, length):
+    # Yields `length` bytes of `f` from `start` on, seeking straight there
+    f.seek(start)
+    while length > 0:
+        chunk = f.read(min(CHUNK_SIZE, length))
+        if not chunk:
+            return
+        length -= len(chunk)
+        yield chunk
@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Every directory the app writes to goes under one temp dir, set before the
+# backend modules read their config at import
+ROOT = tempfile.mkdtemp(prefix='downloader-tests-')
+os.environ.update({
+    'DOWNLOAD_DIR': os.path.join(ROOT, 'downloads'),
+    'MEDIA_STORE_DIR': os.path.join(ROOT, 'media_store'),
+    'ARCHIVE_STATE_DIR': os.path.join(ROOT, 'archive_state'),
+    'METADATA_CACHE_PATH': '',
+    'MEDIA_GRACE_PERIOD': '0',
+    'LOG_LEVEL': 'WARNING',
+})
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app
+
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,94 @@
+import os
+
+
+def publish(store, key, directory, size):
+    path = os.path.join(directory, f'{key[0].replace(":", "_")}.mp4')
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+    return store.publish(key, path, 'media.mp4')
+
+
+def test_closing_an_unread_media_response_releases_its_pin(app_module, client, tmp_path, monkeypatch):
+    store = app_module.media_store
+    entry = publish(store, ('youtube:abortedsend', 'mp4', 'best'), tmp_path, 1024 ** 2)
+
+    response = client.get(f'/media/{store.digest(entry.key)}', buffered=False)
+    assert response.status_code == 200
+    assert store.stats()["open_readers"] == 1
+
+    # Evicted while it is being sent: the file has to outlive the send
+    monkeypatch.setattr(store, 'max_bytes', 0)
+    publish(store, ('youtube:evictsothers', 'mp4', 'best'), tmp_path, 1024)
+    assert store.lookup(store.digest(entry.key)) is None
+    assert os.path.exists(entry.path)
+    assert store.stats()["pending_removal"] == 1
+
+    # The client goes away without reading the body
+    response.close()
+
+    assert store.stats()["open_readers"] == 0
+    assert store.stats()["pending_removal"] == 0
+    assert not os.path.exists(entry.path)
+
+
+def test_download_is_refused_with_507_when_scratch_is_full(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module.scratch, 'min_free_bytes', float('inf'))
+    refused = app_module.scratch.stats()["refused"]
+    jobs = app_module.job_manager.stats()["jobs"]
+
+    response = client.post('/download', data={'url': 'https://www.youtube.com/watch?v=scratchfull', 'format': 'mp4'})
+
+    assert response.status_code == 507
+    assert "disk space" in response.get_json()["error"]
+    assert app_module.scratch.stats()["refused"] == refused + 1
+    assert app_module.job_manager.stats()["jobs"] == jobs
+
+
+def test_playlist_is_refused_with_507_before_streaming(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module.scratch, 'min_free_bytes', float('inf'))
+
+    response = client.post('/download/playlist', data={
+        'url': 'https://www.youtube.com/playlist?list=PLscratchfull', 'mode': 'zip',
+    })
+
+    assert response.status_code == 507
+
+
+def test_media_resumes_and_revalidates_with_each_request_counted_once(app_module, client, tmp_path):
+    store = app_module.media_store
+    entry = publish(store, ('youtube:resumesend', 'mp4', 'best'), tmp_path, 4096)
+    url = f'/media/{store.digest(entry.key)}'
+
+    def served(status):
+        for _, labels, value in app_module.metrics.requests_total.samples():
+            if labels == f'{{endpoint="media_file",status="{status}"}}':
+                return value
+        return 0
+
+    before = served(206), served(304)
+
+    response = client.get(url, headers={'Range': 'bytes=1024-'}, buffered=True)
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 1024-4095/4096'
+    assert len(response.data) == 3072
+
+    response = client.get(url, headers={'If-None-Match': response.headers['ETag']}, buffered=True)
+    assert response.status_code == 304
+
+    assert (served(206), served(304)) == (before[0] + 1, before[1] + 1)
+    assert store.stats()["open_readers"] == 0
+
+
+def test_media_range_is_read_from_its_start(app_module, client, tmp_path):
+    store = app_module.media_store
+    path = tmp_path / 'rangesend.mp4'
+    data = os.urandom(256 * 1024)
+    path.write_bytes(data)
+    entry = store.publish(('youtube:rangesend', 'mp4', 'best'), str(path), 'media.mp4')
+
+    response = client.get(f'/media/{store.digest(entry.key)}', headers={'Range': 'bytes=200000-200999'},
+                          buffered=True)
+
+    assert response.status_code == 206
+    assert response.data == data[200000:201000]
+    assert store.stats()["open_readers"] == 0
@@ -0,0 +1,31 @@
+import threading
+
+from jobs import Job, JobManager
+
+
+def test_jobs_left_queued_by_a_timed_out_drain_are_failed():
+    manager = JobManager(workers=1, platform_limits={'youtube': 1, 'instagram': 1})
+    release = threading.Event()
+    finished = []
+
+    def download(job):
+        release.wait(5)
+        return '/dev/null', 'media.mp4'
+
+    running = manager.submit(Job('https://www.youtube.com/watch?v=running0001', 'mp4', 'youtube'), download)
+    # Behind the youtube limit, and behind the executor's only worker
+    pending = manager.submit(Job('https://www.youtube.com/watch?v=pending0001', 'mp4', 'youtube'), download,
+                             finished.append)
+    waiting = manager.submit(Job('https://www.instagram.com/p/waiting/', 'mp4', 'instagram'), download,
+                             finished.append)
+    try:
+        assert not manager.drain(timeout=0.1)
+    finally:
+        release.set()
+
+    assert {job.id for job in finished} == {pending.id, waiting.id}
+    for job in (pending, waiting):
+        assert job.status == 'failed'
+        assert job.events.closed
+        assert job.progress["phase"] == 'done'
+    assert running.status in ('running', 'finished')
@@ -0,0 +1,28 @@
+import instaloader
+import pytest
+
+from failures import failure_reason
+from pools import InstaloaderPool
+
+DEAD_POST = instaloader.exceptions.BadResponseException("Fetching Post metadata failed.")
+
+
+def test_deleted_instagram_post_is_not_found():
+    assert failure_reason(DEAD_POST) == 'not_found'
+
+
+def fail_leases(pool, error, times):
+    for _ in range(times):
+        with pytest.raises(type(error)):
+            with pool.lease():
+                raise error
+
+
+def test_dead_links_do_not_replace_a_healthy_context():
+    pool = InstaloaderPool(size=1, max_failures=3)
+
+    fail_leases(pool, DEAD_POST, 3)
+    assert pool.stats()["replacements"] == 0
+
+    fail_leases(pool, instaloader.exceptions.ConnectionException("Connection reset"), 3)
+    assert pool.stats()["replacements"] == 1
@@ -0,0 +1,23 @@
+import yt_dlp
+
+
+def video(video_id):
+    return {'id': video_id, 'title': f'Video {video_id}', 'duration': 60, 'extractor': 'youtube',
+            'extractor_key': 'Youtube', 'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+            'formats': [{'format_id': '18', 'url': f'https://example.invalid/{video_id}.mp4', 'ext': 'mp4',
+                         'vcodec': 'avc1', 'acodec': 'mp4a', 'height': 360}]}
+
+
+def test_playlist_check_survives_the_metadata_cache(client, monkeypatch):
+    def extract_info(self, url, download=True, ie_key=None, extra_info=None, process=True, **kwargs):
+        # The tab extractor hands its entries back as a generator
+        return {'_type': 'playlist', 'id': 'PLcheck', 'title': 'Checked playlist', 'extractor': 'youtube:tab',
+                'extractor_key': 'YoutubeTab', 'webpage_url': url,
+                'entries': (video(f'vid{index:08d}') for index in range(3))}
+
+    monkeypatch.setattr(yt_dlp.YoutubeDL, 'extract_info', extract_info)
+
+    for _ in range(2):
+        response = client.post('/check', data={'url': 'https://www.youtube.com/playlist?list=PLcheck'})
+        assert response.status_code == 200, response.get_json()
+        assert response.get_json()["title"] == 'Checked playlist'
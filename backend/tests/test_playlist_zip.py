@@ -0,0 +1,35 @@
+import threading
+import time
+
+import playlists
+
+
+def test_abandoned_playlist_zip_stops_queueing(tmp_path, monkeypatch):
+    media = tmp_path / 'entry.mp4'
+    media.write_bytes(b'\0' * 1024)
+    queued = []
+    released = threading.Event()
+
+    def iter_entries(url, limit):
+        try:
+            for index in range(limit):
+                yield index, f'https://www.youtube.com/watch?v=entry{index:06d}', f'Entry {index}'
+                time.sleep(0.01)
+        finally:
+            # Where the real expansion gives its pool lease back
+            released.set()
+
+    def enqueue_download(job_manager, job, on_done=None):
+        queued.append(job)
+        job.status, job.file_path, job.download_name = 'finished', str(media), 'entry.mp4'
+        on_done(job)
+
+    monkeypatch.setattr(playlists, 'iter_entries', iter_entries)
+    monkeypatch.setattr(playlists, 'enqueue_download', enqueue_download)
+
+    stream = playlists.playlist_zip(None, 'https://www.youtube.com/playlist?list=PLabandoned', 'mp4', 100)
+    next(stream)
+    stream.close()
+
+    assert released.wait(5)
+    assert len(queued) < 100
@@ -0,0 +1,73 @@
+import io
+import json
+import zipfile
+from datetime import datetime, timezone
+
+import profiles
+from profiles import HighWaterMarks, profile_zip
+
+
+class FakePost:
+    typename = 'GraphImage'
+    is_video = False
+    is_pinned = False
+    owner_username = 'someone'
+
+    def __init__(self, timestamp):
+        self.shortcode = f'post{timestamp}'
+        self.date_utc = datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+        self.url = f'https://cdn.invalid/{self.shortcode}.jpg'
+
+
+class FakeProfile:
+    username = 'someone'
+    profile_pic_url = ''
+    posts = [FakePost(timestamp) for timestamp in (500, 400, 300, 200, 100)]
+
+    def __init__(self, context=None, node=None):
+        self._node = node or {}
+
+    def get_posts(self):
+        return iter(self.posts)
+
+
+def archive(monkeypatch, marks, since, before):
+    # Returns the posts in the zip's manifest, and the mark as it stood when
+    # the last chunk had been handed over
+    monkeypatch.setattr(profiles.instaloader, 'Profile', FakeProfile)
+    monkeypatch.setattr('posts.iter_content', lambda url: iter([b'image']))
+    body = io.BytesIO()
+    for chunk in profile_zip(FakeProfile(), since, before, limit=2, marks=marks):
+        body.write(chunk)
+        mark_while_sending = marks.get('someone')
+    with zipfile.ZipFile(body) as zf:
+        manifest = json.loads(zf.read('manifest.json'))
+    return [post["shortcode"] for post in manifest["posts"]], mark_while_sending
+
+
+def next_archive(marks):
+    # What profile_archive asks for without parameters
+    mark = marks.get('someone') or {}
+    backfill = mark.get("backfill")
+    if backfill:
+        return backfill["since"], backfill["before"]
+    return mark.get("timestamp"), None
+
+
+def test_truncated_archives_backfill_before_the_mark_moves(monkeypatch, tmp_path):
+    marks = HighWaterMarks(str(tmp_path))
+    archived = []
+
+    for expected in (['post500', 'post400'], ['post300', 'post200'], ['post100']):
+        before_send = marks.get('someone')
+        posts, mark_while_sending = archive(monkeypatch, marks, *next_archive(marks))
+        assert posts == expected
+        # Written only after the whole zip has gone out
+        assert mark_while_sending == before_send
+        archived += posts
+        if expected != ['post100']:
+            assert marks.get('someone')["timestamp"] is None
+
+    assert archived == [post.shortcode for post in FakeProfile.posts]
+    assert marks.get('someone') == {"shortcode": 'post500', "timestamp": 500}
+    assert archive(monkeypatch, marks, *next_archive(marks))[0] == []
@@ -0,0 +1,43 @@
+import os
+import time
+
+from urls import media_key
+
+
+def test_throttled_download_waits_out_the_negative_cache(app_module, tmp_path, monkeypatch):
+    import downloader
+
+    url = 'https://www.youtube.com/watch?v=throttled01'
+    key = (media_key(url), 'mp4', 'best')
+    now = [time.time()]
+    delays = []
+    upstream = []
+
+    def sleep(delay):
+        delays.append(delay)
+        now[0] += delay
+
+    def download_youtube(url, format_type, key, workdir):
+        # The metadata lookup is guarded as get_youtube_info's is
+        with downloader.negative_cache.guard(media_key(url)):
+            upstream.append(url)
+            if len(upstream) == 1:
+                raise downloader.DownloadError('ERROR: HTTP Error 429: Too Many Requests')
+        path = os.path.join(workdir, 'throttled01.mp4')
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 1024)
+        return path, 'media.mp4', 'none'
+
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    monkeypatch.setattr(downloader.time, 'sleep', sleep)
+    monkeypatch.setattr(downloader, 'download_youtube', download_youtube)
+    job = app_module.Job(url, 'mp4', 'youtube')
+
+    stored = downloader.fetch_media(job, key)
+
+    assert os.path.exists(stored.path)
+    assert len(upstream) == 2
+    # The throttled lookup is remembered; its entry is waited out, not
+    # retried against every second until the attempts run out
+    assert sum(delays) >= downloader.config.NEGATIVE_CACHE_TTLS['throttled']
+    assert len(delays) <= 2
@@ -0,0 +1,18 @@
+import pytest
+
+from urls import classify, story_owner
+
+
+@pytest.mark.parametrize('url', [
+    'https://www.instagram.com/stories/foo.bar/3123456789/',
+    'instagram.com/stories/foo.bar/3123456789/',
+    'www.instagram.com/stories/foo.bar/3123456789',
+])
+def test_story_owner_follows_classify(url):
+    assert classify(url).kind == 'story'
+    assert story_owner(url) == 'foo.bar'
+
+
+def test_story_owner_is_none_for_other_urls():
+    assert story_owner('instagram.com/stories/highlights/17890000000000000/') is None
+    assert story_owner('https://www.instagram.com/foo.bar/') is None
@@ -0,0 +1,120 @@
+import re
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+# Canonical identity of what a URL points at. `platform` picks the extractor
+# family: anything that isn't Instagram goes through yt-dlp, which shares the
+# 'youtube' queue, pools and limits. `kind` is one of post, story, highlight,
+# profile (Instagram), video, playlist, channel (YouTube), or url for pages
+# no rule matches (other sites go to yt-dlp's generic extractors), whose id is
+# the URL without its fragment.
+MediaRef = namedtuple('MediaRef', ['platform', 'kind', 'id'])
+
+# Single items keep the bare `platform:id` key so existing cache and media
+# store entries stay valid; collections are namespaced by kind.
+SINGLE_KINDS = ('post', 'video', 'url')
+
+# Instagram paths that look like a profile but aren't one
+INSTAGRAM_RESERVED = frozenset((
+    'about', 'accounts', 'developer', 'direct', 'explore', 'legal', 'p', 'reel', 'reels', 'stories', 'tv',
+    'web',
+))
+
+# Ordered (path pattern, query parameter, kind) rules per site. A rule with a
+# query parameter takes the id from that parameter; otherwise the id is the
+# pattern's `id` group. The first rule that yields an id wins.
+INSTAGRAM_ROUTES = [
+    (r'/(?:[\w.]+/)?(?:p|reels?|tv)/(?P<id>[\w-]+)', None, 'post'),
+    (r'/stories/highlights/(?P<id>\d+)', None, 'highlight'),
+    (r'/stories/(?P<owner>[\w.]+)/(?P<id>\d+)', None, 'story'),
+    (r'/(?P<id>[\w.]+)/?$', None, 'profile'),
+]
+YOUTUBE_ROUTES = [
+    (r'/watch/?$', 'v', 'video'),
+    (r'/(?:shorts|embed|live|v|e)/(?P<id>[\w-]{11})(?:/|$)', None, 'video'),
+    (r'/playlist/?$', 'list', 'playlist'),
+    (r'/channel/(?P<id>UC[\w-]{22})(?:/|$)', None, 'channel'),
+    (r'/(?P<id>@[\w.-]+)(?:/|$)', None, 'channel'),
+    (r'/(?P<id>(?:c|user)/[\w.-]+)(?:/|$)', None, 'channel'),
+]
+YOUTU_BE_ROUTES = [
+    (r'/(?P<id>[\w-]{11})(?:/|$)', None, 'video'),
+]
+
+# Host, without a www./m./music. prefix -> (platform, rules)
+SITES = {
+    'instagram.com': ('instagram', INSTAGRAM_ROUTES),
+    'instagr.am': ('instagram', INSTAGRAM_ROUTES),
+    'youtube.com': ('youtube', YOUTUBE_ROUTES),
+    'youtube-nocookie.com': ('youtube', YOUTUBE_ROUTES),
+    'youtu.be': ('youtube', YOUTU_BE_ROUTES),
+}
+QUERY_IDS = {
+    'v': re.compile(r'(?:^|&)v=([\w-]{11})(?:&|$)'),
+    'list': re.compile(r'(?:^|&)list=([\w-]+)(?:&|$)'),
+}
+COMPILED_SITES = {
+    host: (platform, [(re.compile(pattern), param, kind) for pattern, param, kind in rules])
+    for host, (platform, rules) in SITES.items()
+}
+HOST_PREFIXES = ('www.', 'm.', 'music.')
+
+
+def classify(url):
+    # Pure string work, no network: a few microseconds per URL
+    return _resolve(url)[0]
+
+
+def story_owner(url):
+    # Username a story URL names, /stories/<username>/<mediaid>/, or None
+    # for other URLs
+    ref, match = _resolve(url)
+    return match.group('owner') if ref.kind == 'story' else None
+
+
+def _resolve(url):
+    # (MediaRef, the rule's path match or None)
+    url = url.strip()
+    if '://' not in url:
+        url = '//' + url
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return MediaRef('youtube', 'url', url), None
+    host = (parts.hostname or '').rstrip('.')
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+
+    platform, rules = COMPILED_SITES.get(host, ('youtube', ()))
+    for pattern, param, kind in rules:
+        match = pattern.match(parts.path)
+        if match is None:
+            continue
+        if param is not None:
+            found = QUERY_IDS[param].search(parts.query)
+            if found is None:
+                continue
+            return MediaRef(platform, kind, found.group(1)), match
+        media_id = match.group('id')
+        if kind == 'profile':
+            if media_id.lower() in INSTAGRAM_RESERVED:
+                continue
+            media_id = media_id.lower()
+        return MediaRef(platform, kind, media_id), match
+
+    # Pages we have no rule for; Instagram ones still can't go to yt-dlp
+    return MediaRef(platform, 'url', parts._replace(fragment='').geturl()), None
+
+
+def media_key(url):
+    # Cache, dedup and routing key shared by every URL shape for the same media
+    ref = classify(url)
+    if ref.kind in SINGLE_KINDS:
+        return f'{ref.platform}:{ref.id}'
+    return f'{ref.platform}:{ref.kind}:{ref.id}'
+
+
+def platform_of(url):
+    return classify(url).platform
@@ -0,0 +1,68 @@
+import time
+import zipfile
+
+CHUNK_SIZE = 256 * 1024
+
+
+class _Sink:
+    # Write-only file object that collects what zipfile writes so it can be
+    # handed to the response. No tell()/seek(), so zipfile falls back to
+    # streaming mode with data descriptors.
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    # Builds a zip archive on the fly. Every add_* method is a generator that
+    # yields archive bytes as they become available, so members are sent to
+    # the client while later ones are still being fetched. Media is already
+    # compressed, so members are stored rather than deflated.
+
+    def __init__(self):
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True)
+        self._names = set()
+
+    def add_file(self, name, path):
+        with open(path, 'rb') as f:
+            yield from self.add_stream(name, iter(lambda: f.read(CHUNK_SIZE), b''))
+
+    def add_bytes(self, name, data):
+        yield from self.add_stream(name, [data])
+
+    def add_stream(self, name, chunks):
+        info = zipfile.ZipInfo(self._unique(name), date_time=time.localtime()[:6])
+        with self._zip.open(info, 'w', force_zip64=True) as member:
+            for chunk in chunks:
+                member.write(chunk)
+                data = self._sink.drain()
+                if data:
+                    yield data
+        yield self._sink.drain()
+
+    def close(self):
+        self._zip.close()
+        yield self._sink.drain()
+
+    def _unique(self, name):
+        name = name.replace('/', '_').replace('\\', '_') or 'file'
+        candidate, counter = name, 1
+        while candidate in self._names:
+            stem, dot, ext = name.rpartition('.')
+            candidate = f"{stem} ({counter}).{ext}" if dot else f"{name} ({counter})"
+            counter += 1
+        self._names.add(candidate)
+        return candidate
@@ -0,0 +1,104 @@
+"""Latency of POST /check with and without the pooled YoutubeDL instances.
+
+By default the metadata cache is seeded with a synthetic info dict, so the
+numbers isolate the per-request cost of building (or leasing) a YoutubeDL and
+running format selection, with no network involved. Pass --url to measure a
+live extraction instead (the metadata cache is disabled for that run).
+
+    python benchmarks/bench_check.py --requests 200
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+BENCH_URL = 'https://www.youtube.com/watch?v=benchcheck1'
+BENCH_INFO = {
+    '_type': 'video',
+    'id': 'benchcheck1',
+    'title': 'Benchmark video',
+    'duration': 60,
+    'thumbnail': 'http://127.0.0.1/thumb.jpg',
+    'extractor': 'youtube',
+    'extractor_key': 'Youtube',
+    'webpage_url': BENCH_URL,
+    'formats': [
+        {'format_id': '18', 'url': 'http://127.0.0.1/18.mp4', 'ext': 'mp4', 'protocol': 'https',
+         'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'width': 640, 'height': 360, 'tbr': 500},
+        {'format_id': '137', 'url': 'http://127.0.0.1/137.mp4', 'ext': 'mp4', 'protocol': 'https',
+         'vcodec': 'avc1.640028', 'acodec': 'none', 'width': 1920, 'height': 1080, 'tbr': 4000},
+        {'format_id': '140', 'url': 'http://127.0.0.1/140.m4a', 'ext': 'm4a', 'protocol': 'https',
+         'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 128},
+    ],
+}
+
+
+def run_variant(requests, url):
+    sys.path.insert(0, BACKEND)
+    os.chdir(tempfile.mkdtemp(prefix='bench-check-'))
+    import app as app_module
+    from downloader import metadata_cache
+    from urls import media_key
+
+    if url is None:
+        url = BENCH_URL
+        metadata_cache.set(media_key(url), BENCH_INFO, ttl=3600)
+
+    client = app_module.app.test_client()
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.post('/check', data={'url': url})
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise SystemExit(f"/check failed: {response.get_json()}")
+
+    latencies.sort()
+    print(json.dumps({
+        "requests": requests,
+        "median_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--url', help='measure a live URL instead of the synthetic cached one')
+    parser.add_argument('--pool-size', type=int, default=2, help='YTDL_POOL_SIZE for the pooled run')
+    parser.add_argument('--variant', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args.requests, args.url)
+        return
+
+    # Each variant runs in its own process so module-level pools and caches
+    # are built from that variant's environment.
+    results = {}
+    for name, pool_size in (('unpooled', 0), ('pooled', args.pool_size)):
+        env = dict(os.environ, YTDL_POOL_SIZE=str(pool_size))
+        if args.url:
+            env['METADATA_CACHE_TTL'] = '0'
+        cmd = [sys.executable, os.path.abspath(__file__), '--variant', '--requests', str(args.requests)]
+        if args.url:
+            cmd += ['--url', args.url]
+        output = subprocess.run(cmd, env=env, check=True, capture_output=True, text=True).stdout
+        results[name] = json.loads(output.strip().splitlines()[-1])
+
+    for name, result in results.items():
+        print(f"{name:>9}: median {result['median_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms "
+              f"over {result['requests']} requests")
+    speedup = results['unpooled']['median_ms'] / results['pooled']['median_ms']
+    print(f"median speedup: {speedup:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
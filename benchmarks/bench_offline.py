@@ -0,0 +1,315 @@
+"""Offline benchmark suite for /check and /download, with stub extractors.
+
+YouTube and Instagram are replaced by the stand-ins in stubs.py: extraction
+returns synthetic info dicts whose formats point at a local HTTP server. The
+downloads, postprocessing and the app itself are the real thing. Each
+scenario runs in its own process, so peak RSS and ffmpeg CPU time (CPU used
+by child processes) are per scenario.
+
+Scenarios:
+  check            POST /check, a new video each time (extraction + format selection)
+  check_cached     POST /check for the same video (metadata cache hits)
+  instagram_check  POST /check for a new Instagram post each time
+  progressive      POST /download?stream=1 of a single-file mp4, then fetch the file (no ffmpeg)
+  mp4              mp4 download merging separate video and audio (ffmpeg)
+  mp3              mp3 download transcoding the audio (ffmpeg)
+  instagram        Instagram video download
+  duplicate        --concurrency simultaneous downloads of the same new video per iteration
+
+Output is JSON; pass --compare with an earlier result to see the change.
+
+    python benchmarks/bench_offline.py --output before.json
+    python benchmarks/bench_offline.py --compare before.json --scenarios check,mp4
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(BENCHMARKS, '..', 'backend')
+
+SCENARIOS = ('check', 'check_cached', 'instagram_check', 'progressive', 'mp4', 'mp3', 'instagram', 'duplicate')
+NEEDS_FFMPEG = ('mp4', 'mp3')
+
+# Lift every limit that would make the benchmark measure our own pacing
+CHILD_ENV = {
+    'LOG_LEVEL': 'WARNING',
+    'YOUTUBE_RATE': '1000000',
+    'YOUTUBE_BURST': '1000000',
+    'INSTAGRAM_RATE': '1000000',
+    'INSTAGRAM_BURST': '1000000',
+    'INSTAGRAM_MIN_INTERVAL': '0.000001',
+    'SCRATCH_MIN_FREE_BYTES': '0',
+    'MEDIA_GRACE_PERIOD': '0',
+    'METADATA_CACHE_PATH': '',
+}
+
+
+class Runner:
+    def __init__(self, server, concurrency):
+        import app as app_module
+
+        self.app_module = app_module
+        self.app = app_module.create_app()
+        self.server = server
+        self.concurrency = concurrency
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def unique_id(self, prefix):
+        with self._lock:
+            self._counter += 1
+            # 11 characters, like a YouTube id: kind, process, sequence
+            return f'{prefix[:1]}{os.getpid() % 1000:03d}{self._counter:07d}'
+
+    def check(self, client, url):
+        response = client.post('/check', data={'url': url})
+        if response.status_code != 200:
+            raise RuntimeError(response.get_json())
+
+    def download(self, client, url, format_type, stream=False):
+        response = client.post('/download', data={'url': url, 'format': format_type, 'stream': '1' if stream else ''})
+        if response.status_code != 202:
+            raise RuntimeError(response.get_json())
+        job = self.app_module.job_manager.get(response.get_json()['job_id'])
+        seq = 0
+        while not job.done:
+            events = job.events.wait(after=seq, timeout=1)
+            if events:
+                seq = events[-1]['seq']
+        if job.status != 'finished':
+            raise RuntimeError(job.error)
+        response = client.get(f'/jobs/{job.id}/file')
+        try:
+            body = response.get_data()
+        finally:
+            response.close()
+        if response.status_code != 200:
+            raise RuntimeError(f"/jobs/{job.id}/file answered {response.status_code}")
+        if len(body) != os.path.getsize(job.file_path):
+            raise RuntimeError(f"/jobs/{job.id}/file sent {len(body)} of {os.path.getsize(job.file_path)} bytes")
+
+    def operation(self, scenario):
+        # Returns a callable(client) performing one iteration of `scenario`
+        youtube = 'https://www.youtube.com/watch?v={}'
+        instagram = 'https://www.instagram.com/reel/{}/'
+        if scenario == 'check':
+            return lambda client: self.check(client, youtube.format(self.unique_id('c')))
+        if scenario == 'check_cached':
+            url = youtube.format(self.unique_id('k'))
+            return lambda client: self.check(client, url)
+        if scenario == 'instagram_check':
+            return lambda client: self.check(client, instagram.format(self.unique_id('I')))
+        if scenario == 'progressive':
+            return lambda client: self.download(client, youtube.format(self.unique_id('p')), 'mp4', stream=True)
+        if scenario in ('mp4', 'mp3'):
+            return lambda client: self.download(client, youtube.format(self.unique_id(scenario)), scenario)
+        if scenario == 'instagram':
+            return lambda client: self.download(client, instagram.format(self.unique_id('D')), 'mp4')
+        if scenario == 'duplicate':
+            return self.duplicate
+        raise ValueError(scenario)
+
+    def duplicate(self, client):
+        # All clients ask for the same new video at once; single-flight should
+        # turn that into one download
+        url = 'https://www.youtube.com/watch?v={}'.format(self.unique_id('d'))
+        stream = shutil.which('ffmpeg') is None
+        errors = []
+
+        def one():
+            try:
+                self.download(self.app.test_client(), url, 'mp4', stream)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=one) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def run(self, scenario, iterations, warmup):
+        op = self.operation(scenario)
+        client = self.app.test_client()
+        for _ in range(warmup):
+            op(client)
+
+        workers = 1 if scenario == 'duplicate' else self.concurrency
+        latencies, errors = [], []
+        remaining = [iterations]
+        lock = threading.Lock()
+
+        def worker():
+            client = self.app.test_client()
+            while True:
+                with lock:
+                    if not remaining[0]:
+                        return
+                    remaining[0] -= 1
+                started = time.perf_counter()
+                try:
+                    op(client)
+                except Exception as e:
+                    with lock:
+                        errors.append(str(e))
+                    continue
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+        children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        from downloader import downloads_in_flight, extractions_in_flight
+        return dict(
+            summarize(latencies),
+            iterations=iterations,
+            concurrency=self.concurrency,
+            errors=len(errors),
+            first_error=errors[0] if errors else None,
+            wall_s=wall,
+            throughput_per_s=len(latencies) / wall if wall else 0.0,
+            peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            ffmpeg_cpu_s=(children_after.ru_utime + children_after.ru_stime
+                          - children_before.ru_utime - children_before.ru_stime),
+            downloads_in_flight=downloads_in_flight.stats(),
+            extractions_in_flight=extractions_in_flight.stats(),
+        )
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else None
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    ms = lambda value: None if value is None else value * 1000  # noqa: E731
+    return {
+        "ok": len(latencies),
+        "mean_ms": ms(statistics.mean(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p90_ms": ms(percentile(latencies, 0.90)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "max_ms": ms(latencies[-1]) if latencies else None,
+    }
+
+
+def run_scenario(args):
+    sys.path.insert(0, BACKEND)
+    sys.path.insert(0, BENCHMARKS)
+    os.chdir(tempfile.mkdtemp(prefix=f'bench-{args.scenario}-'))
+    import stubs
+
+    server = stubs.MediaServer(args.media_dir)
+    stubs.install_youtube_stub(server, latency=args.extract_latency)
+    stubs.install_instagram_stub(server, latency=args.extract_latency)
+    result = Runner(server, args.concurrency).run(args.scenario, args.iterations, args.warmup)
+    print(json.dumps(result))
+
+
+def compare(current, baseline):
+    print(f"{'scenario':<16} {'p50 ms':>18} {'throughput/s':>22} {'peak RSS MB':>18}")
+    for name, result in current.items():
+        before = baseline.get(name)
+        if not before or 'skipped' in result or 'skipped' in before:
+            continue
+
+        def cell(key, fmt):
+            old, new = before.get(key), result.get(key)
+            if old is None or new is None:
+                return 'n/a'
+            change = (new - old) / old * 100 if old else 0.0
+            return f"{fmt.format(new)} ({change:+.1f}%)"
+
+        print(f"{name:<16} {cell('p50_ms', '{:.2f}'):>18} {cell('throughput_per_s', '{:.1f}'):>22} "
+              f"{cell('peak_rss_mb', '{:.0f}'):>18}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated subset to run')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--extract-latency', type=float, default=0.0, help='simulated seconds per extraction')
+    parser.add_argument('--media-seconds', type=int, default=10, help='length of the synthetic media')
+    parser.add_argument('--media-dir', help='reuse synthetic media from this directory')
+    parser.add_argument('--output', help='write the JSON result here as well as to stdout')
+    parser.add_argument('--compare', help='earlier JSON result to compare against')
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        run_scenario(args)
+        return
+
+    sys.path.insert(0, BENCHMARKS)
+    import stubs
+
+    media_dir = args.media_dir or tempfile.mkdtemp(prefix='bench-media-')
+    real_media = stubs.make_media(media_dir, args.media_seconds)
+
+    results = {}
+    for name in args.scenarios.split(','):
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name}; choose from {', '.join(SCENARIOS)}")
+        if name in NEEDS_FFMPEG and not real_media:
+            results[name] = {"skipped": "ffmpeg not available"}
+            continue
+        cmd = [sys.executable, os.path.abspath(__file__), '--scenario', name, '--media-dir', media_dir,
+               '--iterations', str(args.iterations), '--warmup', str(args.warmup),
+               '--concurrency', str(args.concurrency), '--extract-latency', str(args.extract_latency)]
+        proc = subprocess.run(cmd, env=dict(os.environ, **CHILD_ENV), capture_output=True, text=True)
+        if proc.returncode != 0:
+            results[name] = {"failed": proc.stderr.strip().splitlines()[-1:] or ['unknown error']}
+            continue
+        results[name] = json.loads(proc.stdout.strip().splitlines()[-1])
+        print(f"{name}: done", file=sys.stderr)
+
+    output = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "ffmpeg": real_media,
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "extract_latency": args.extract_latency,
+            "media_seconds": args.media_seconds,
+        },
+        "scenarios": results,
+    }
+    text = json.dumps(output, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["scenarios"])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Single-connection vs segmented downloads from a throttled local server.
+
+A ThrottledServer (stubs.py) caps every connection at --rate KiB/s, the way
+media CDNs pace each connection. The same --size MiB file is fetched with
+cdn.download over one connection, then over each --connections count. With
+--ytdlp the file is also downloaded through yt-dlp, once with its native
+http downloader and once handed to SegmentedFD (segmented.py), so the whole
+download_youtube() path is measured.
+
+    python benchmarks/bench_segmented.py --size 32 --rate 2048 --connections 2,4,8
+    python benchmarks/bench_segmented.py --ytdlp --segment-size 1
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(BENCHMARKS, '..', 'backend')
+
+
+def digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def timed(name, fn, expected):
+    started = time.perf_counter()
+    path = fn()
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(path)
+    result = {"variant": name, "seconds": round(elapsed, 3), "mib_per_s": round(size / 1024 ** 2 / elapsed, 2),
+              "intact": digest(path) == expected}
+    os.remove(path)
+    print(f"{name}: {elapsed:.2f}s", file=sys.stderr)
+    return result
+
+
+def ytdlp_download(url, workdir, external_downloader):
+    import yt_dlp
+
+    info = {
+        'id': f'bench{external_downloader}',
+        'title': 'Segmented benchmark',
+        'extractor': 'generic',
+        'extractor_key': 'Generic',
+        'webpage_url': url,
+        'formats': [{'format_id': 'progressive', 'url': url, 'ext': 'mp4', 'protocol': 'http',
+                     'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2'}],
+    }
+    options = {'outtmpl': f'{workdir}/%(id)s.%(ext)s', 'quiet': True, 'noprogress': True,
+               'external_downloader': {'http': external_downloader}}
+    with yt_dlp.YoutubeDL(options) as ydl:
+        info = ydl.process_ie_result(info, download=True)
+        return ydl.prepare_filename(info)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--size', type=int, default=32, help='file size in MiB')
+    parser.add_argument('--rate', type=int, default=2048, help='KiB/s per connection')
+    parser.add_argument('--connections', default='2,4,8', help='comma separated connection counts')
+    parser.add_argument('--segment-size', type=float, default=4, help='segment size in MiB')
+    parser.add_argument('--ytdlp', action='store_true', help='also download through yt-dlp')
+    parser.add_argument('--output', help='write the JSON result here as well as to stdout')
+    args = parser.parse_args()
+
+    sys.path.insert(0, BACKEND)
+    sys.path.insert(0, BENCHMARKS)
+    import cdn
+    import stubs
+
+    workdir = tempfile.mkdtemp(prefix='bench-segmented-')
+    source = os.path.join(workdir, 'media.mp4')
+    with open(source, 'wb') as f:
+        f.write(os.urandom(args.size * 1024 ** 2))
+    expected = digest(source)
+    server = stubs.ThrottledServer(workdir, args.rate * 1024)
+    url = f'{server.base_url}/media.mp4'
+    target = os.path.join(workdir, 'out.mp4')
+    segment_size = int(args.segment_size * 1024 ** 2)
+
+    def fetch(connections):
+        cdn.download(url, target, connections=connections, segment_size=segment_size)
+        return target
+
+    results = [timed('single', lambda: fetch(1), expected)]
+    for connections in (int(value) for value in args.connections.split(',')):
+        results.append(timed(f'segmented x{connections}', lambda: fetch(connections), expected))
+    if args.ytdlp:
+        import config
+        import segmented
+
+        config.CDN_SEGMENT_SIZE = segment_size
+        results.append(timed('yt-dlp native', lambda: ytdlp_download(url, workdir, 'native'), expected))
+        results.append(timed(f'yt-dlp segmented x{config.CDN_CONNECTIONS}',
+                             lambda: ytdlp_download(url, workdir, segmented.SEGMENTED), expected))
+    server.close()
+
+    output = {"size_mib": args.size, "rate_kib_s": args.rate, "segment_mib": args.segment_size, "results": results}
+    text = json.dumps(output, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Correctness fuzzing and throughput of the URL classifier (backend/urls.py).
+
+Every URL in the corpus is checked against its expected (platform, kind, id),
+then mutated the ways clients paste links (tracking parameters, fragments,
+case, trailing slashes, missing scheme, mobile hosts), and each mutation must
+still classify the same. Random garbage must classify without raising.
+Finally classify() is timed over the whole corpus.
+
+    python benchmarks/bench_urls.py --mutations 200 --rounds 20000
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from urls import classify, media_key  # noqa: E402
+
+# (url, platform, kind, id) for the URL shapes seen in requests
+CORPUS = [
+    ('https://www.instagram.com/p/CxYz12_-ab/', 'instagram', 'post', 'CxYz12_-ab'),
+    ('https://www.instagram.com/reel/C0aBcDeFgHi/', 'instagram', 'post', 'C0aBcDeFgHi'),
+    ('https://www.instagram.com/reels/C0aBcDeFgHi/', 'instagram', 'post', 'C0aBcDeFgHi'),
+    ('https://www.instagram.com/tv/B9xYz123abc/', 'instagram', 'post', 'B9xYz123abc'),
+    ('https://www.instagram.com/nasa/p/CxYz12_-ab/', 'instagram', 'post', 'CxYz12_-ab'),
+    ('https://www.instagram.com/nasa/reel/C0aBcDeFgHi/', 'instagram', 'post', 'C0aBcDeFgHi'),
+    ('https://instagr.am/p/CxYz12_-ab/', 'instagram', 'post', 'CxYz12_-ab'),
+    ('https://www.instagram.com/stories/nasa/3214567890123456789/', 'instagram', 'story', '3214567890123456789'),
+    ('https://www.instagram.com/stories/highlights/17912345678901234/', 'instagram', 'highlight',
+     '17912345678901234'),
+    ('https://www.instagram.com/nasa/', 'instagram', 'profile', 'nasa'),
+    ('https://www.instagram.com/some.user_name/', 'instagram', 'profile', 'some.user_name'),
+    ('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'youtube', 'video', 'dQw4w9WgXcQ'),
+    ('https://www.youtube.com/watch?feature=shared&v=dQw4w9WgXcQ', 'youtube', 'video', 'dQw4w9WgXcQ'),
+    ('https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf&index=3', 'youtube',
+     'video', 'dQw4w9WgXcQ'),
+    ('https://m.youtube.com/watch?v=dQw4w9WgXcQ', 'youtube', 'video', 'dQw4w9WgXcQ'),
+    ('https://music.youtube.com/watch?v=dQw4w9WgXcQ', 'youtube', 'video', 'dQw4w9WgXcQ'),
+    ('https://youtu.be/dQw4w9WgXcQ', 'youtube', 'video', 'dQw4w9WgXcQ'),
+    ('https://youtu.be/dQw4w9WgXcQ?si=AbCdEfGhIjKlMnOp&t=42', 'youtube', 'video', 'dQw4w9WgXcQ'),
+    ('https://www.youtube.com/shorts/aBcDeFgHiJk', 'youtube', 'video', 'aBcDeFgHiJk'),
+    ('https://www.youtube.com/embed/dQw4w9WgXcQ?start=10', 'youtube', 'video', 'dQw4w9WgXcQ'),
+    ('https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ', 'youtube', 'video', 'dQw4w9WgXcQ'),
+    ('https://www.youtube.com/live/dQw4w9WgXcQ?feature=share', 'youtube', 'video', 'dQw4w9WgXcQ'),
+    ('https://www.youtube.com/playlist?list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf', 'youtube', 'playlist',
+     'PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf'),
+    ('https://www.youtube.com/@NASA', 'youtube', 'channel', '@NASA'),
+    ('https://www.youtube.com/@NASA/videos', 'youtube', 'channel', '@NASA'),
+    ('https://www.youtube.com/channel/UCLA_DiR1FfKNvjuUpBHmylQ', 'youtube', 'channel', 'UCLA_DiR1FfKNvjuUpBHmylQ'),
+    ('https://www.youtube.com/c/NASA/featured', 'youtube', 'channel', 'c/NASA'),
+    ('https://www.youtube.com/user/NASAtelevision', 'youtube', 'channel', 'user/NASAtelevision'),
+    ('https://vimeo.com/76979871', 'youtube', 'url', 'https://vimeo.com/76979871'),
+    ('https://www.instagram.com/explore/', 'instagram', 'url', 'https://www.instagram.com/explore/'),
+]
+
+
+def mutations(url, rng):
+    # Variants of `url` that must classify the same as the original
+    scheme, rest = url.split('://', 1)
+    host, _, tail = rest.partition('/')
+    path, sep, query = tail.partition('?')
+    tracking = rng.choice(['utm_source=ig_web_copy_link', 'igsh=MTc4MmM1YmI2Ng==', 'si=abc123', 'feature=share'])
+
+    yield url + '#' + rng.choice(['t=30', 'comments', ''])
+    yield url + ('&' if sep else '?') + tracking
+    if sep:
+        yield f"{scheme}://{host}/{path}?{tracking}&{query}"
+    yield rest
+    yield '  ' + url + '\n'
+    yield f"http://{host}/{tail}"
+    yield f"{scheme}://{host.upper()}/{tail}"
+    yield f"{scheme}://{host}./{tail}"
+    if host.startswith('www.'):
+        yield f"{scheme}://{host[len('www.'):]}/{tail}"
+        yield f"{scheme}://m.{host[len('www.'):]}/{tail}"
+    if path and not path.endswith('/'):
+        yield f"{scheme}://{host}/{path}/{sep}{query}"
+    elif path.endswith('/') and path.count('/') > 1:
+        yield f"{scheme}://{host}/{path.rstrip('/')}{sep}{query}"
+
+
+def garbage(rng):
+    alphabet = string.ascii_letters + string.digits + ':/?#[]@!$&\'()*+,;=%-._~ \té中'
+    prefixes = ['', 'https://', 'https://www.youtube.com/', 'https://www.instagram.com/', '//', 'http://[', '::']
+    return rng.choice(prefixes) + ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 60)))
+
+
+def check(mutation_count, seed):
+    rng = random.Random(seed)
+    failures = []
+    checked = 0
+    for url, platform, kind, media_id in CORPUS:
+        expected = (platform, kind, media_id)
+        got = tuple(classify(url))
+        checked += 1
+        if got != expected:
+            failures.append((url, expected, got))
+            continue
+        if kind == 'url':
+            # The id is the URL itself, so mutations legitimately change it
+            continue
+        for _ in range(max(1, mutation_count // 10)):
+            for variant in mutations(url, rng):
+                checked += 1
+                if tuple(classify(variant)) != expected:
+                    failures.append((variant, expected, tuple(classify(variant))))
+
+    for _ in range(mutation_count):
+        url = garbage(rng)
+        checked += 1
+        try:
+            media_key(url)
+        except Exception as e:
+            failures.append((url, 'no exception', repr(e)))
+    return checked, failures
+
+
+def bench(rounds):
+    urls = [url for url, *_ in CORPUS]
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for url in urls:
+            classify(url)
+    elapsed = time.perf_counter() - started
+    return elapsed / (rounds * len(urls)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mutations', type=int, default=200, help='random garbage URLs (and mutation rounds / 10)')
+    parser.add_argument('--rounds', type=int, default=10000, help='passes over the corpus for the timing')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    checked, failures = check(args.mutations, args.seed)
+    for url, expected, got in failures[:20]:
+        print(f"MISMATCH {url!r}: expected {expected}, got {got}")
+    print(f"checked {checked} URLs, {len(failures)} mismatches")
+
+    per_url = bench(args.rounds)
+    print(f"classify: {per_url:.2f} us/URL over {args.rounds * len(CORPUS)} calls")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
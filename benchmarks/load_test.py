@@ -0,0 +1,158 @@
+"""Requests/sec of POST /check under concurrent load, against a stubbed extractor.
+
+Starts the app in a child process the way production runs it (gunicorn with
+gunicorn.conf.py when gunicorn is installed, otherwise Werkzeug's threaded
+server), with the metadata cache seeded with a synthetic info dict so no
+request leaves the machine. Then `--concurrency` client threads hammer
+/check over keep-alive connections for `--duration` seconds.
+
+    python benchmarks/load_test.py --concurrency 32 --duration 20
+    python benchmarks/load_test.py --server werkzeug
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(BENCHMARKS, '..', 'backend')
+
+sys.path.insert(0, BENCHMARKS)
+from bench_check import BENCH_INFO, BENCH_URL  # noqa: E402
+
+
+def serve(port, server):
+    sys.path.insert(0, BACKEND)
+    os.chdir(tempfile.mkdtemp(prefix='load-test-'))
+    import app as app_module
+    from downloader import metadata_cache
+    from urls import media_key
+
+    metadata_cache.set(media_key(BENCH_URL), BENCH_INFO, ttl=24 * 3600)
+    application = app_module.create_app()
+
+    if server == 'gunicorn':
+        from gunicorn.app.base import BaseApplication
+
+        class Server(BaseApplication):
+            def load_config(self):
+                self.cfg.set('config', os.path.join(BACKEND, 'gunicorn.conf.py'))
+                self.load_config_from_file(self.cfg.config)
+                self.cfg.set('bind', f'127.0.0.1:{port}')
+                self.cfg.set('accesslog', None)
+
+            def load(self):
+                return application
+
+        Server().run()
+    else:
+        from werkzeug.serving import make_server
+        make_server('127.0.0.1', port, application, threaded=True).serve_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f"Server did not come up on port {port}")
+
+
+def client(port, deadline, latencies, errors):
+    body = urlencode({'url': BENCH_URL})
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            conn.request('POST', '/check', body, headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--server', choices=('gunicorn', 'werkzeug'), help='default: gunicorn if installed')
+    parser.add_argument('--serve', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    server = args.server
+    if server is None:
+        try:
+            import gunicorn  # noqa: F401
+            server = 'gunicorn'
+        except ImportError:
+            server = 'werkzeug'
+
+    if args.serve:
+        serve(args.serve, server)
+        return
+
+    port = free_port()
+    env = dict(os.environ, LOG_LEVEL='WARNING', METADATA_CACHE_TTL=str(24 * 3600))
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port), '--server', server],
+                            env=env)
+    try:
+        wait_until_up(port)
+        latencies, errors = [], []
+        deadline = time.perf_counter() + args.duration
+        threads = [threading.Thread(target=client, args=(port, deadline, latencies, errors))
+                   for _ in range(args.concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        proc.terminate()
+        proc.wait(timeout=60)
+
+    latencies.sort()
+    result = {
+        "server": server,
+        "concurrency": args.concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_sec": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
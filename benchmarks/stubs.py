@@ -0,0 +1,193 @@
+"""Deterministic local stand-ins for YouTube and Instagram, for offline benchmarks.
+
+- make_media() writes synthetic media: real H.264/AAC files when ffmpeg is
+  available (so merges and transcodes do real work), otherwise filler bytes
+  of the same size.
+- MediaServer serves those files over HTTP on 127.0.0.1; ThrottledServer
+  does too with Range support and a per-connection rate limit, like a CDN.
+- install_youtube_stub() replaces YoutubeDL.extract_info so any
+  youtube.com/watch?v=<11 chars> URL extracts to an info dict whose formats
+  point at the media server. Format selection, downloading and ffmpeg
+  postprocessing stay real yt-dlp code.
+- install_instagram_stub() does the same for instaloader.Post.from_shortcode;
+  the video itself is then fetched from the media server like any CDN URL.
+"""
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+import zlib
+from functools import partial
+from http.server import BaseHTTPRequestHandler, SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+# File name -> what the synthetic info dict advertises for it
+MEDIA = {
+    'video.mp4': {'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1.640028', 'acodec': 'none',
+                  'width': 1280, 'height': 720, 'tbr': 2000},
+    'audio.m4a': {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 128},
+    'progressive.mp4': {'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2',
+                        'width': 640, 'height': 360, 'tbr': 600},
+}
+FFMPEG_SOURCES = {
+    'video.mp4': ['-f', 'lavfi', '-i', 'testsrc=size=1280x720:rate=30', '-c:v', 'libx264', '-preset', 'ultrafast',
+                  '-pix_fmt', 'yuv420p', '-an'],
+    'audio.m4a': ['-f', 'lavfi', '-i', 'sine=frequency=440', '-c:a', 'aac', '-b:a', '128k', '-vn'],
+    'progressive.mp4': ['-f', 'lavfi', '-i', 'testsrc=size=640x360:rate=30', '-f', 'lavfi', '-i',
+                        'sine=frequency=440', '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+                        '-c:a', 'aac', '-shortest'],
+}
+YOUTUBE_URL = re.compile(r'[?&]v=([\w-]{11})')
+RANGE = re.compile(r'bytes=(\d+)-(\d*)$')
+
+
+def make_media(directory, seconds=10):
+    # Returns whether the files are real media (ffmpeg was available)
+    os.makedirs(directory, exist_ok=True)
+    real = shutil.which('ffmpeg') is not None
+    for name, args in FFMPEG_SOURCES.items():
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            continue
+        if real:
+            subprocess.run(['ffmpeg', '-y', '-loglevel', 'error'] + args + ['-t', str(seconds), path], check=True)
+        else:
+            rate = MEDIA[name].get('tbr') or MEDIA[name].get('abr')
+            with open(path, 'wb') as f:
+                f.write(os.urandom(rate * 1000 // 8 * seconds))
+    return real
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class MediaServer:
+    def __init__(self, directory):
+        self.directory = directory
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), partial(_QuietHandler, directory=directory))
+        self.base_url = f'http://127.0.0.1:{self._server.server_address[1]}'
+        threading.Thread(target=self._server.serve_forever, name='media-server', daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+
+
+class _ThrottledHandler(BaseHTTPRequestHandler):
+    # Serves files from `directory` with single Range support, sending at most
+    # `rate` bytes per second per connection
+    directory = None
+    rate = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = os.path.join(self.directory, os.path.basename(self.path.split('?')[0]))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        match = RANGE.match(self.headers.get('Range', ''))
+        start, end = 0, size - 1
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or size - 1), size - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+
+        chunk_size = 16 * 1024
+        started = time.monotonic()
+        sent = 0
+        with open(path, 'rb') as f:
+            f.seek(start)
+            while sent < end - start + 1:
+                chunk = f.read(min(chunk_size, end - start + 1 - sent))
+                try:
+                    self.wfile.write(chunk)
+                except OSError:
+                    return
+                sent += len(chunk)
+                ahead = sent / self.rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+
+class ThrottledServer(MediaServer):
+    def __init__(self, directory, rate):
+        # `rate` in bytes per second, per connection
+        self.directory = directory
+        handler = type('Handler', (_ThrottledHandler,), {'directory': directory, 'rate': rate})
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._server.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self._server.server_address[1]}'
+        threading.Thread(target=self._server.serve_forever, name='throttled-server', daemon=True).start()
+
+
+def youtube_info(video_id, server):
+    formats = []
+    for name, fields in MEDIA.items():
+        path = os.path.join(server.directory, name)
+        formats.append(dict(fields, url=f'{server.base_url}/{name}', protocol='http',
+                            filesize=os.path.getsize(path)))
+    return {
+        'id': video_id,
+        'title': f'Benchmark video {video_id}',
+        'duration': 10,
+        'thumbnail': f'{server.base_url}/thumb.jpg',
+        'extractor': 'youtube',
+        'extractor_key': 'Youtube',
+        'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+        'formats': formats,
+    }
+
+
+def install_youtube_stub(server, latency=0.0):
+    # `latency` seconds of simulated extraction time per call
+    import yt_dlp
+
+    def extract_info(self, url, download=True, ie_key=None, extra_info=None, process=True,
+                     force_generic_extractor=False):
+        match = YOUTUBE_URL.search(url)
+        if match is None:
+            raise yt_dlp.utils.DownloadError(f'ERROR: Unsupported URL: {url}')
+        if latency:
+            time.sleep(latency)
+        info = youtube_info(match.group(1), server)
+        return self.process_ie_result(info, download=download) if process else info
+
+    yt_dlp.YoutubeDL.extract_info = extract_info
+
+
+def instagram_node(shortcode, server):
+    return {
+        'id': str(zlib.crc32(shortcode.encode('utf-8'))),
+        'shortcode': shortcode,
+        '__typename': 'GraphVideo',
+        'is_video': True,
+        'video_url': f'{server.base_url}/progressive.mp4',
+        'display_url': f'{server.base_url}/thumb.jpg',
+        'video_duration': 10.0,
+        'taken_at_timestamp': 1700000000,
+        'owner': {'id': '1', 'username': 'benchmark'},
+        'edge_media_to_caption': {'edges': [{'node': {'text': f'Benchmark post {shortcode}'}}]},
+    }
+
+
+def install_instagram_stub(server, latency=0.0):
+    import instaloader
+
+    def from_shortcode(cls, context, shortcode):
+        if latency:
+            time.sleep(latency)
+        return cls(context, instagram_node(shortcode, server))
+
+    instaloader.Post.from_shortcode = classmethod(from_shortcode)
@@ -21,6 +21,9 @@ document.addEventListener('DOMContentLoaded', function() {
     const videoPreview = document.getElementById('video-preview');
     const downloadBurst = document.getElementById('download-burst');
     
+    // Last successful /check, so downloads know what kind of media it was
+    let checked = null;
+    
     // Instagram content types
     const postsType = document.getElementById('posts-type');
     const storiesType = document.getElementById('stories-type');
@@ -254,6 +257,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 <p>Quality: ${data.quality}</p>
                 <img src="${data.thumbnail}" alt="Thumbnail" style="max-width: 200px;">
             `;
+            checked = { url: url, data: data };
             downloadButton.disabled = false;
             checkButton.textContent = 'Check Media';
             checkButton.disabled = false;
@@ -303,6 +307,55 @@ document.addEventListener('DOMContentLoaded', function() {
         }, 1500);
     }
     
+    // Button labels for the server-side phases of a download
+    const phaseLabels = {
+        queued: 'Queued...',
+        waiting: 'Waiting (rate limited)...',
+        fetch: 'Downloading...',
+        merge: 'Merging...',
+        remux: 'Remuxing...',
+        transcode: 'Converting...'
+    };
+    
+    // Follow a queued download job's progress events until it finishes
+    function waitForJob(job) {
+        return new Promise((resolve, reject) => {
+            const events = new EventSource(job.events_url);
+            events.addEventListener('progress', function(e) {
+                const data = JSON.parse(e.data);
+                if (data.percent !== undefined && data.percent !== null) {
+                    progressBar.style.width = `${data.percent}%`;
+                }
+                if (phaseLabels[data.phase]) {
+                    const percent = data.phase === 'fetch' && data.percent ? ` ${Math.floor(data.percent)}%` : '';
+                    downloadButton.textContent = phaseLabels[data.phase] + percent;
+                }
+                if (data.status === 'finished') {
+                    events.close();
+                    resolve(job);
+                } else if (data.status === 'failed') {
+                    events.close();
+                    reject(new Error(data.error || 'Download failed'));
+                }
+            });
+            events.onerror = function() {
+                // EventSource reconnects on its own unless the stream is gone for good
+                if (events.readyState === EventSource.CLOSED) {
+                    reject(new Error('Lost connection to the server'));
+                }
+            };
+        });
+    }
+    
+    // Hand a URL to the browser so its own download manager fetches it
+    function saveFrom(href) {
+        const a = document.createElement('a');
+        a.href = href;
+        document.body.appendChild(a);
+        a.click();
+        a.remove();
+    }
+    
     // Download button functionality
     downloadButton.addEventListener('click', function(e) {
         e.preventDefault();
@@ -314,6 +367,13 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         
+        // Image and carousel posts are streamed as a zip; no job to wait for
+        if (checked && checked.url === url && checked.data.zip_url) {
+            saveFrom(checked.data.zip_url);
+            createBurstEffect();
+            return;
+        }
+        
         // Add downloading class
         downloadButton.classList.add('downloading');
         downloadButton.textContent = 'Downloading...';
@@ -321,18 +381,7 @@ document.addEventListener('DOMContentLoaded', function() {
         // Show progress
         progressContainer.classList.add('show');
         
-        // Simulate progress (since we can't track real progress easily)
-        let progress = 0;
-        const interval = setInterval(() => {
-            progress += Math.random() * 10;
-            if (progress > 100) progress = 100;
-            
-            progressBar.style.width = `${progress}%`;
-            
-            if (progress === 100) {
-                clearInterval(interval);
-            }
-        }, 200);
+        progressBar.style.width = '0';
         
         // Make request to /download endpoint
         const formData = new FormData();
@@ -347,23 +396,20 @@ document.addEventListener('DOMContentLoaded', function() {
             if (!response.ok) {
                 throw new Error('Download failed: ' + response.statusText);
             }
-            const contentDisposition = response.headers.get('Content-Disposition');
-            let filename = `media.${format}`;
-            if (contentDisposition) {
-                const match = contentDisposition.match(/filename="(.+)"/);
-                if (match) filename = match[1];
+            return response.json();
+        })
+        .then(job => waitForJob(job))
+        .then(job => fetch(job.status_url))
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Download failed: ' + response.statusText);
             }
-            return response.blob().then(blob => ({ blob, filename }));
+            return response.json();
         })
-        .then(({ blob, filename }) => {
-            const url = window.URL.createObjectURL(blob);
-            const a = document.createElement('a');
-            a.href = url;
-            a.download = filename;
-            document.body.appendChild(a);
-            a.click();
-            a.remove();
-            window.URL.revokeObjectURL(url);
+        .then(status => {
+            // The file's stable URL, so the browser can pause/resume with
+            // Range requests
+            saveFrom(status.media_url);
             
             // Show burst effect
             createBurstEffect();